@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+import sys
+from pathlib import Path
+
+# The modules of this package run as scripts from its directory, e.g.
+# python make_dataset.py, and import their sibling modules by name. Importing the
+# package puts the directory first on the path as well, so that the same imports
+# resolve for src.data.make_dataset from the repository root.
+_package_dir = str(Path(__file__).resolve().parent)
+if _package_dir not in sys.path:
+    sys.path.insert(0, _package_dir)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import time
+from pathlib import Path
+import pandas as pd
+
+from make_dataset import brand_preprocess, extract_brands
+
+
+def time_call(func, repeat=3):
+    """Runs func repeat times and returns the best wall time.
+
+    Args:
+        func (callable): Function without arguments.
+        repeat (int, optional): Number of runs. Defaults to 3.
+
+    Returns:
+        [tuple]: (best wall time in seconds, result of the last run)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+@click.command()
+@click.argument("clean_data_path", type=click.Path(exists=True))
+@click.option("--rows", default=20000, type=int, help="Number of sampled rows.")
+@click.option("--repeat", default=3, type=int, help="Runs per implementation.")
+def main(clean_data_path="../../data/processed/clean_data.csv", rows=20000, repeat=3):
+    """ Compares the throughput of the row-wise brand_preprocess with the
+        column-level extract_brands on products of clean_data.csv.
+    """
+    logger = logging.getLogger(__name__)
+
+    df = pd.read_csv(Path(clean_data_path), usecols=["product", "category"])
+    df = df.sample(min(rows, len(df)), random_state=0).reset_index(drop=True)
+
+    row_time, row_brands = time_call(lambda: df.apply(brand_preprocess, axis=1), repeat)
+    col_time, col_brands = time_call(
+        lambda: extract_brands(df["product"], df["category"]), repeat
+    )
+
+    assert row_brands.equals(col_brands), "extract_brands differs from brand_preprocess"
+
+    logger.info("brand_preprocess: %.0f rows/s", len(df) / row_time)
+    logger.info("extract_brands:   %.0f rows/s", len(df) / col_time)
+    logger.info("speedup: %.1fx", row_time / col_time)
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    main()
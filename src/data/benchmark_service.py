@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import click
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import quote
+import numpy as np
+
+from risk_service import load_service, make_server
+
+
+def run_client(port, paths, latencies):
+    """Sends requests over one keep-alive connection and records their latencies.
+
+    Args:
+        port (int): Port of the service on localhost.
+        paths (list): Request paths.
+        latencies (list): Latencies in seconds, appended to.
+    """
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    for path in paths:
+        start = time.perf_counter()
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def time_batches(port, names, sizes, repeat=5):
+    """Measures the latency of POST /batch for shopping lists of several sizes.
+
+    Args:
+        port (int): Port of the service on localhost.
+        names (list): Product names to draw the lists from.
+        sizes (list): List sizes.
+        repeat (int, optional): Requests per size. Defaults to 5.
+
+    Returns:
+        [dict]: list size to best latency in seconds.
+    """
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    latencies = {}
+    for size in sizes:
+        body = json.dumps({"items": names[:size]})
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.request("POST", "/batch", body, {"Content-Type": "application/json"})
+            conn.getresponse().read()
+            best = min(best, time.perf_counter() - start)
+        latencies[size] = best
+    conn.close()
+    return latencies
+
+
+@click.command()
+@click.argument("processed_dirpath", type=click.Path(exists=True))
+@click.option("--clients", default=8, type=int, help="Concurrent connections.")
+@click.option("--requests", default=2000, type=int, help="Requests per connection.")
+def main(processed_dirpath="../../data/processed", clients=8, requests=2000):
+    """ Measures the latency of the risk service under concurrent autocomplete and
+        statistics requests for names of the processed data.
+    """
+    logger = logging.getLogger(__name__)
+
+    start = time.perf_counter()
+    service = load_service(processed_dirpath)
+    logger.info("Service loaded in %.1f s", time.perf_counter() - start)
+
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    rng = random.Random(0)
+    names = [(k, n) for k in service.stats for n in service.stats[k]]
+    latencies = [[] for _ in range(clients)]
+    threads = []
+    for i in range(clients):
+        paths = []
+        for _ in range(requests):
+            kind, name = rng.choice(names)
+            if rng.random() < 0.5:
+                prefix = name[: rng.randint(1, min(len(name), 8))]
+                paths.append("/autocomplete?q=%s" % quote(prefix))
+            else:
+                paths.append("/stats?name=%s&type=%s" % (quote(name), kind))
+        threads.append(
+            threading.Thread(target=run_client, args=(port, paths, latencies[i]))
+        )
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    products = list(service.stats["product"])
+    rng.shuffle(products)
+    for size, latency in time_batches(port, products, [1, 10, 100, 1000]).items():
+        logger.info("batch of %4d products: %.2f ms", size, latency * 1e3)
+    server.shutdown()
+
+    latencies = np.concatenate([np.array(x) for x in latencies]) * 1e3
+    logger.info(
+        "%d requests from %d clients: %.0f requests/s",
+        len(latencies),
+        clients,
+        len(latencies) / elapsed,
+    )
+    logger.info(
+        "latency p50 %.2f ms  p95 %.2f ms  p99 %.2f ms  max %.2f ms",
+        *np.percentile(latencies, [50, 95, 99, 100])
+    )
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    main()
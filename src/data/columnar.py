@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import importlib.util
+import shutil
+from pathlib import Path
+from urllib.parse import quote, unquote
+import pandas as pd
+
+from schema import apply_schema
+
+# Directory of the columnar store inside the processed data directory.
+COLUMNAR_DIR = "columnar"
+
+# Partition value used for reports without a year or category.
+NULL_PARTITION = "__null__"
+
+
+def check_parquet_engine():
+    """Fails early when no parquet engine is installed.
+
+    Raises:
+        ImportError: when neither pyarrow nor fastparquet can be imported.
+    """
+    if not any(importlib.util.find_spec(m) for m in ["pyarrow", "fastparquet"]):
+        raise ImportError(
+            "The columnar output needs pyarrow or fastparquet: pip install pyarrow"
+        )
+
+
+def report_years(df):
+    """Gets the year of every report, from the year column when present and from
+    the report creation date otherwise.
+
+    Args:
+        df (pd.DataFrame): Processed CAERS data.
+
+    Returns:
+        [pd.Series]: year of every report.
+    """
+    if "year" in df.columns:
+        return df["year"]
+    dates = df["time_stamp"] if "time_stamp" in df.columns else df["caers_created_date"]
+    return pd.to_datetime(dates).dt.year
+
+
+def partition_dir(year, category):
+    """Gets the relative directory of a (year, category) partition. Category names
+    contain "/" so they are percent-encoded.
+
+    Args:
+        year (int): Partition year, or None.
+        category (str): Partition category, or None.
+
+    Returns:
+        [Path]: relative partition directory.
+    """
+    year = NULL_PARTITION if pd.isna(year) else str(int(year))
+    category = NULL_PARTITION if pd.isna(category) else quote(str(category), safe="")
+    return Path("year=%s" % year) / ("category=%s" % category)
+
+
+def parse_partition_dir(path):
+    """Inverse of partition_dir.
+
+    Args:
+        path (Path): Directory of a partition file.
+
+    Returns:
+        [tuple]: (year, category) of the partition, None for null values.
+    """
+    year = path.parent.name.split("=", 1)[1]
+    category = path.name.split("=", 1)[1]
+    return (
+        None if year == NULL_PARTITION else int(year),
+        None if category == NULL_PARTITION else unquote(category),
+    )
+
+
+def write_partition(df, path):
+    """Writes the rows of one partition to a parquet file. Categorical columns
+    keep only the categories present in these rows; otherwise every file would
+    store the dictionaries of the whole data set, e.g. all report ids.
+
+    Args:
+        df (pd.DataFrame): Rows of the partition.
+        path (Path): Output parquet file.
+    """
+    categorical = df.select_dtypes("category").columns
+    df = df.assign(
+        **{col: df[col].cat.remove_unused_categories() for col in categorical}
+    )
+    df.to_parquet(path, index=False)
+
+
+def write_partitioned(df, root, part):
+    """Writes df as one parquet file per (year, category) partition under root.
+    Successive writes with different part numbers add files to the partitions.
+
+    Args:
+        df (pd.DataFrame): Processed CAERS data.
+        root (Path): Directory of the data set in the columnar store.
+        part (int): Number identifying this write, e.g. the row offset.
+    """
+    df = df.reset_index(drop=True)
+    years = report_years(df).values
+    categories = df["category"].astype(object).values
+    keys = pd.DataFrame({"year": years, "category": categories})
+
+    for (year, category), rows in keys.groupby(
+        ["year", "category"], dropna=False, sort=False
+    ).indices.items():
+        path = root / partition_dir(year, category)
+        path.mkdir(parents=True, exist_ok=True)
+        write_partition(df.iloc[rows], path / ("part-%09d.parquet" % part))
+
+
+def remove_partitioned(root):
+    """Removes a data set from the columnar store.
+
+    Args:
+        root (Path): Directory of the data set in the columnar store.
+    """
+    if root.exists():
+        shutil.rmtree(root)
+
+
+def read_partitioned(root, columns=None, years=None, categories=None):
+    """Reads a data set of the columnar store. Only the requested columns are read
+    and partitions outside years and categories are skipped without being opened.
+    Rows are grouped by partition, not in the order of the csv outputs.
+
+    Args:
+        root (Path): Directory of the data set in the columnar store.
+        columns (list, optional): Columns to be read. Defaults to None (all columns).
+        years (list, optional): Years to be read. Defaults to None (all years).
+        categories (list, optional): Categories to be read. Defaults to None (all categories).
+
+    Returns:
+        [pd.DataFrame]: Typed data.
+    """
+    root = Path(root)
+    frames = []
+    for path in sorted(root.glob("year=*/category=*/*.parquet")):
+        year, category = parse_partition_dir(path.parent)
+        if years is not None and year not in years:
+            continue
+        if categories is not None and category not in categories:
+            continue
+        frames.append(pd.read_parquet(path, columns=columns))
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    # Categoricals of different partitions have different categories, so the
+    # schema is applied again on the concatenated frame.
+    return apply_schema(pd.concat(frames, ignore_index=True))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from multivalue import encode_multivalued, explode_positions
+
+# Dimensions of the brand plots. complete tells whether the exploded row has
+# no missing value in any column, the rows that brands_vs_outcomes_plot keeps
+# after dropna. Brands are nearly as many as reports, so this cube is kept free
+# of the month, sex and age dimensions.
+BRAND_DIMENSIONS = ["year", "category", "outcomes", "brand", "complete"]
+
+# Dimensions of the time, category and outcome plots.
+TIME_DIMENSIONS = ["year", "month", "category", "outcomes"]
+
+# events counts the rows of the exploded data set in a cell and reports the
+# reports of the report-grain data set. A report is counted in the cell of its
+# first outcome, so reports only add up over slices that keep every outcome.
+CUBE_MEASURES = ["events", "reports"]
+
+# Report-grain output from which every cube is built, blank outcome replacement
+# of its exploded data set and dimensions of the cube.
+CUBE_OUTPUTS = {
+    "cube_data": ("processed_data", None, BRAND_DIMENSIONS),
+    "cube_data_time": ("clean_data_time", "Not Specified", TIME_DIMENSIONS),
+}
+
+# Product name of redacted reports. Their brands are derived from the product
+# name, so they are stored under the product name itself.
+REDACTED_PRODUCT = "EXEMPTION 4"
+
+
+def build_cube(reports, dimensions, blank=None):
+    """Counts the reports and their exploded outcome rows per cell of dimensions.
+
+    Args:
+        reports (pd.DataFrame): Report-grain processed data, e.g. processed_data.
+        dimensions (list): Dimensions of the cube, e.g. TIME_DIMENSIONS.
+        blank (str, optional): Replacement of empty outcomes, e.g. "Not Specified". Defaults to None (missing).
+
+    Returns:
+        [pd.DataFrame]: dimensions and CUBE_MEASURES of every non-empty cell.
+    """
+    assert isinstance(
+        reports, pd.DataFrame
+    ), "Check whether reports is Pandas Dataframe or not."
+
+    reports = reports.reset_index(drop=True)
+    if "time_stamp" in reports.columns:
+        dates = pd.to_datetime(reports["time_stamp"])
+    else:
+        dates = pd.to_datetime(reports["caers_created_date"])
+    product = reports["product"].astype(object)
+    brand = (
+        reports["brand"]
+        .astype(object)
+        .where(product != REDACTED_PRODUCT, REDACTED_PRODUCT)
+    )
+
+    mv = encode_multivalued(reports["outcomes"])
+    rows, codes = explode_positions(mv)
+    dictionary = np.array(mv.dictionary + [None], dtype=object)
+    dictionary[dictionary == ""] = blank
+    # Code -1 of reports without outcomes picks the trailing None.
+    outcomes = dictionary[codes]
+    complete = reports.drop(columns="outcomes").notna().all(axis=1).values[rows]
+
+    cells = pd.DataFrame(
+        {
+            "year": dates.dt.year.values[rows],
+            "month": dates.dt.month.values[rows],
+            "category": reports["category"].astype(object).values[rows],
+            "outcomes": outcomes,
+            "brand": brand.values[rows],
+            "complete": complete & pd.notna(outcomes),
+            "first": np.r_[True, rows[1:] != rows[:-1]] if len(rows) else [],
+        }
+    )
+    cube = (
+        cells.groupby(dimensions, dropna=False, sort=True)["first"]
+        .agg(["size", "sum"])
+        .reset_index()
+        .rename(columns={"size": "events", "sum": "reports"})
+    )
+    cube["reports"] = cube["reports"].astype(np.int64)
+    return cube
+
+
+def merge_cubes(cubes, dimensions):
+    """Adds up the measures of cubes over the same dimensions, e.g. the cubes of
+    successive chunks of reports.
+
+    Args:
+        cubes (list): Cubes as given by build_cube.
+        dimensions (list): Dimensions of the cubes, e.g. TIME_DIMENSIONS.
+
+    Returns:
+        [pd.DataFrame]: dimensions and summed CUBE_MEASURES of every non-empty cell.
+    """
+    cells = pd.concat(cubes, ignore_index=True)
+    # Cubes read back from the outputs have categorical dimensions, which would
+    # group over every combination of categories.
+    for col in dimensions:
+        if cells[col].dtype.name == "category":
+            cells[col] = cells[col].astype(object)
+    return (
+        cells.groupby(dimensions, dropna=False, sort=True)[CUBE_MEASURES]
+        .sum()
+        .reset_index()
+    )
+
+
+def add_cube(cube, reports, dimensions, blank=None):
+    """Adds the counts of reports to a cube, e.g. the counts of rows appended to
+    the outputs to the cube of the rows already written.
+
+    Args:
+        cube (pd.DataFrame): Cube as given by build_cube, or None (empty cube).
+        reports (pd.DataFrame): Report-grain processed data to be counted.
+        dimensions (list): Dimensions of the cube, e.g. TIME_DIMENSIONS.
+        blank (str, optional): Replacement of empty outcomes, e.g. "Not Specified". Defaults to None (missing).
+
+    Returns:
+        [pd.DataFrame]: dimensions and CUBE_MEASURES of every non-empty cell.
+    """
+    delta = build_cube(reports, dimensions, blank)
+    if cube is None:
+        return delta
+    return merge_cubes([cube, delta], dimensions)
@@ -1,11 +1,119 @@
 # -*- coding: utf-8 -*-
 import click
+import hashlib
+import inspect
+import json
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import chain
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import re
+import shutil
 import string
+import time
 from nltk.corpus import stopwords
+from pandas._libs.parsers import STR_NA_VALUES
+
+from columnar import (
+    COLUMNAR_DIR,
+    check_parquet_engine,
+    read_partitioned,
+    remove_partitioned,
+    write_partitioned,
+)
+from cube import CUBE_OUTPUTS, add_cube, build_cube
+from mmap_store import MMAP_DIR, MMAP_OUTPUTS, write_column_store
+from pipeline import (
+    METRICS_DIR,
+    Stage,
+    StageCache,
+    code_version,
+    log_metrics,
+    measure_step,
+    peak_rss_mb,
+    run_stages,
+    write_metrics,
+)
+from schema import SCHEMA, apply_schema, is_list_column, read_processed
+from star_schema import STAR_DIR, StarBuilder, build_star, write_star
+
+OUTPUT_FILES = [
+    "clean_data.csv",
+    "processed_data.csv",
+    "exploded_data.csv",
+    "clean_data_time.csv",
+    "exploded_data_time.csv",
+]
+
+# Stage of the in-memory pipeline writing every output.
+OUTPUT_STAGES = {
+    "clean_data.csv": "clean",
+    "processed_data.csv": "processed",
+    "exploded_data.csv": "explode",
+    "clean_data_time.csv": "time",
+    "exploded_data_time.csv": "time_explode",
+}
+
+# Stages that --only and --from accept. cube, mmap and star run when enabled.
+STAGE_NAMES = [
+    "ingest",
+    "clean",
+    "brand",
+    "age",
+    "processed",
+    "outcomes",
+    "explode",
+    "time_dedup",
+    "time",
+    "time_explode",
+    "cube",
+    "mmap",
+    "star",
+]
+
+# Columns identifying a report in the time-stamp data sets.
+TIME_KEYS = ["report_id", "patient_age", "category", "sex"]
+
+# Peak memory of the streaming pipeline as a multiple of the raw chunk size,
+# covering the enriched, exploded and time-stamp copies of a chunk.
+STREAM_MEMORY_FACTOR = 6
+
+# Files written for every --format choice.
+OUTPUT_FORMATS = {
+    "csv": ["csv"],
+    "parquet": ["parquet"],
+    "both": ["csv", "parquet"],
+}
+
+# Factors converting age units to year(s).
+AGE_CONV = {
+    "month(s)": 1 / 12,
+    "year(s)": 1,
+    "day(s)": 1 / 365,
+    "Decade(s)": 10,
+    "week(s)": 1 / 52,
+}
+
+# Reports with an age unit missing from AGE_CONV, kept next to the outputs.
+QUARANTINE_FILE = "quarantine_age_units.csv"
+
+# Categories whose brand name is made of the first trim_len words of the product.
+TRIM_CATEGORIES = [
+    "Nuts/Edible Seed",
+    "Vit/Min/Prot/Unconv Diet(Human/Animal)",
+]
+
+PUNCTUATION_PATTERN = "[%s]" % re.escape(string.punctuation)
+
+# Raw-file manifest kept next to the processed outputs.
+MANIFEST_FILE = "manifest.json"
+
+# Product to brand dictionary kept across runs next to the processed outputs.
+BRAND_CACHE_FILE = "brand_cache.json"
 
 
 def brand_preprocess(row, trim_len=2):
@@ -38,10 +146,7 @@ def brand_preprocess(row, trim_len=2):
         return ""
 
     # for certain categories use trim length to select brand name.
-    if row["category"] in [
-        "Nuts/Edible Seed",
-        "Vit/Min/Prot/Unconv Diet(Human/Animal)",
-    ]:
+    if row["category"] in TRIM_CATEGORIES:
         return (
             " ".join(nameList)
             if len(nameList) < trim_len
@@ -50,6 +155,202 @@ def brand_preprocess(row, trim_len=2):
     return nameList[0]
 
 
+@lru_cache(maxsize=None)
+def english_stopwords():
+    """Loads the NLTK english stopwords once.
+
+    Returns:
+        [frozenset]: english stopwords.
+    """
+    return frozenset(stopwords.words("english"))
+
+
+def extract_brands(products, categories, trim_len=2):
+    """Column-level version of brand_preprocess. It derives the brand names of all
+    products at once with vectorized string operations and returns the same values
+    as applying brand_preprocess to every row.
+
+    Args:
+        products (pd.Series): Product names.
+        categories (pd.Series): Categories of the products, aligned with products.
+        trim_len (int, optional): Length by which product name has to be trimmed. Defaults to 2.
+
+    Returns:
+        [pd.Series]: brand name corresponding to every product, indexed like products.
+    """
+    assert isinstance(products, pd.Series), "Check whether products is a Series."
+    assert isinstance(categories, pd.Series) and len(categories) == len(
+        products
+    ), "Check whether categories is a Series aligned with products."
+    assert (
+        isinstance(trim_len, int) and trim_len > 0
+    ), "Check whether trim_len is a positive int."
+
+    brands = pd.Series(pd.NA, index=products.index, dtype=object)
+    valid = products.notna().values
+    n_valid = int(valid.sum())
+    if n_valid == 0:
+        return brands
+
+    # Words of every product, indexed by the position of the product.
+    words = (
+        products[valid]
+        .str.replace(PUNCTUATION_PATTERN, "", regex=True)
+        .str.lower()
+        .str.split(" ")
+        .reset_index(drop=True)
+        .explode()
+    )
+    words = words[~words.isin(english_stopwords())].str.upper()
+    rank = words.groupby(level=0).cumcount().values
+    row = words.index.values
+    is_trim = categories[valid].isin(TRIM_CATEGORIES).values
+
+    # Products without any word left keep an empty brand name.
+    result = np.full(n_valid, "", dtype=object)
+    first = rank == 0
+    result[row[first]] = words.values[first]
+    for k in range(1, trim_len):
+        nxt = (rank == k) & is_trim[row]
+        result[row[nxt]] = result[row[nxt]] + " " + words.values[nxt]
+
+    brands[valid] = result
+    return brands
+
+
+def brand_rules_version(trim_len=2):
+    """Fingerprints everything the brand names depend on: trim_len, the trimmed
+    categories, the punctuation and stopword sets and the code of the brand functions.
+
+    Args:
+        trim_len (int, optional): Length by which product name has to be trimmed. Defaults to 2.
+
+    Returns:
+        [str]: Hex digest of the brand rules.
+    """
+    rules = {
+        "trim_len": trim_len,
+        "trim_categories": TRIM_CATEGORIES,
+        "punctuation": PUNCTUATION_PATTERN,
+        "stopwords": sorted(english_stopwords()),
+        "code": inspect.getsource(brand_preprocess) + inspect.getsource(extract_brands),
+    }
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+
+
+def load_brand_cache(path, trim_len=2):
+    """Loads the product to brand dictionary saved by save_brand_cache. A cache
+    made with other brand rules is discarded.
+
+    Args:
+        path (Path): Brand cache file.
+        trim_len (int, optional): Length by which product name has to be trimmed. Defaults to 2.
+
+    Returns:
+        [dict]: brand per product, for trimmed ("trim") and other ("first") categories.
+    """
+    cache = {"trim": {}, "first": {}}
+    if not path.exists():
+        return cache
+
+    saved = json.loads(path.read_text())
+    if saved["version"] != brand_rules_version(trim_len):
+        logging.getLogger(__name__).info("Brand rules changed, discarding brand cache")
+        return cache
+    return saved["brands"]
+
+
+def save_brand_cache(path, cache, trim_len=2):
+    """Saves the product to brand dictionary along with the brand rules version.
+
+    Args:
+        path (Path): Brand cache file.
+        cache (dict): brand per product as returned by load_brand_cache.
+        trim_len (int, optional): Length by which product name has to be trimmed. Defaults to 2.
+    """
+    saved = {"version": brand_rules_version(trim_len), "brands": cache}
+    path.write_text(json.dumps(saved))
+
+
+def cached_extract_brands(products, categories, cache, trim_len=2):
+    """Looks brand names up in cache and only derives the ones of unseen products,
+    adding them to cache.
+
+    Args:
+        products (pd.Series): Product names.
+        categories (pd.Series): Categories of the products, aligned with products.
+        cache (dict): brand per product as returned by load_brand_cache.
+        trim_len (int, optional): Length by which product name has to be trimmed. Defaults to 2.
+
+    Returns:
+        [pd.Series]: brand name corresponding to every product, indexed like products.
+    """
+    kinds = np.where(categories.isin(TRIM_CATEGORIES).values, "trim", "first")
+    brands = pd.Series(
+        [
+            cache[k].get(p) if isinstance(p, str) else None
+            for p, k in zip(products.values, kinds)
+        ],
+        index=products.index,
+        dtype=object,
+    )
+    missing = brands.isna().values
+
+    if missing.any():
+        brands[missing] = extract_brands(
+            products[missing], categories[missing], trim_len=trim_len
+        ).values
+        for p, k, b in zip(products.values[missing], kinds[missing], brands[missing]):
+            if isinstance(p, str):
+                cache[k][p] = b
+
+    logging.getLogger(__name__).info(
+        "Brand cache: %d hits, %d misses", len(brands) - missing.sum(), missing.sum()
+    )
+    return brands
+
+
+def memoized_extract_brands(products, categories, trim_len=2, cache=None):
+    """Derives brand names once per distinct (product, category) pair with
+    extract_brands and maps them back onto all rows.
+
+    Args:
+        products (pd.Series): Product names.
+        categories (pd.Series): Categories of the products, aligned with products.
+        trim_len (int, optional): Length by which product name has to be trimmed. Defaults to 2.
+        cache (dict, optional): Persistent brand cache consulted for the distinct pairs. Defaults to None.
+
+    Returns:
+        [pd.Series]: brand name corresponding to every product, indexed like products.
+    """
+    assert isinstance(products, pd.Series), "Check whether products is a Series."
+    assert isinstance(categories, pd.Series) and len(categories) == len(
+        products
+    ), "Check whether categories is a Series aligned with products."
+
+    pairs = pd.DataFrame({"product": products.values, "category": categories.values})
+    # Groups are numbered in order of first appearance, like the unique rows below.
+    codes = pairs.groupby(["product", "category"], sort=False, dropna=False).ngroup()
+    first = ~codes.duplicated().values
+
+    if cache is None:
+        unique_brands = extract_brands(
+            products[first], categories[first], trim_len=trim_len
+        )
+    else:
+        unique_brands = cached_extract_brands(
+            products[first], categories[first], cache, trim_len=trim_len
+        )
+
+    logger = logging.getLogger(__name__)
+    logger.info(
+        "Brand memo: %d hits, %d misses", len(products) - first.sum(), first.sum()
+    )
+    return pd.Series(
+        unique_brands.values[codes.values], index=products.index, dtype=object
+    )
+
+
 def age_preprocess(row):
     """This function converts age reports to a single unit : year(s)
     since Data has age reported in multiple units like month(s),day(s)
@@ -65,20 +366,35 @@ def age_preprocess(row):
         row, pd.Series
     ), "Check whether the function is called over Series"
 
-    age_conv = {
-        "month(s)": 1 / 12,
-        "year(s)": 1,
-        "day(s)": 1 / 365,
-        "Decade(s)": 10,
-        "week(s)": 1 / 52,
-    }
-
     unit = row["age_units"]
     age = row["patient_age"]
     if pd.isna(age) or pd.isna(unit):
         return -1
     else:
-        return row["patient_age"] * round(age_conv[unit], 4)
+        return row["patient_age"] * round(AGE_CONV[unit], 4)
+
+
+def convert_ages(ages, units):
+    """Column-level version of age_preprocess. Ages are converted to year(s) by
+    mapping every unit to its factor in one pass. Missing ages or units give -1.
+
+    Args:
+        ages (pd.Series): Reported patient ages.
+        units (pd.Series): Units of the ages, aligned with ages.
+
+    Returns:
+        [tuple]: (ages in year(s), mask of the rows whose unit is not in AGE_CONV)
+    """
+    assert isinstance(ages, pd.Series), "Check whether ages is a Series."
+    assert isinstance(units, pd.Series) and len(units) == len(
+        ages
+    ), "Check whether units is a Series aligned with ages."
+
+    factors = units.map({unit: round(f, 4) for unit, f in AGE_CONV.items()})
+    known = ages.notna() & units.notna()
+    unknown = known & factors.isna()
+    years = (ages.astype(float) * factors).where(known, -1.0)
+    return years, unknown
 
 
 def strip_str(x):
@@ -87,83 +403,1521 @@ def strip_str(x):
     return x
 
 
-@click.command()
-@click.argument("input_dirpath", type=click.Path(exists=True))
-@click.argument("output_dirpath", type=click.Path())
-def main(
-    input_dirpath="../../data/raw/", output_dirpath="../../data/processed",
-):
-    """ Runs data processing scripts to turn raw data from (../raw) into
-        cleaned data ready to be analyzed (saved in ../processed).
+def strip_columns(df):
+    """Column-level version of applymap(strip_str). Only object columns are
+    stripped, one column at a time, and values that are not strings are kept.
+
+    Args:
+        df (pd.DataFrame): Input frame.
+
+    Returns:
+        [pd.DataFrame]: Frame with stripped string values.
     """
-    outPath = Path(output_dirpath)
-    inPath = Path(input_dirpath)
+    df = df.copy(deep=False)
+    for col in df.select_dtypes(include="object").columns:
+        # A plain loop over the column values is faster than Series.str.strip,
+        # which also has to mask out the values that are not strings.
+        values = df[col].values
+        df[col] = np.array(
+            [x.strip() if isinstance(x, str) else x for x in values], dtype=object
+        )
+    return df
 
-    logger = logging.getLogger(__name__)
-    logger.info("Creating clean unified data from raw files")
 
-    aggReports = None
+def normalize_raw_frame(curr_df):
+    """Normalizes column names of a raw CAERS frame and strips its string values.
+
+    Args:
+        curr_df (pd.DataFrame): Frame as parsed from a raw CAERS file.
+
+    Returns:
+        [pd.DataFrame]: Frame with snake_case column names and stripped strings.
+    """
+    column_map = {x: x.lower().replace(" ", "_") for x in curr_df.columns}
+    curr_df = curr_df.rename(columns=column_map)
+    curr_df = curr_df.rename(
+        columns={"meddra_preferred_terms": "medra_preferred_terms"}
+    )
+    return strip_columns(curr_df)
 
-    for p in list(inPath.glob("*.csv")):
 
-        curr_df = pd.read_csv(p, encoding="unicode_escape")
+def read_raw_file(path):
+    """Parses a single raw CAERS file into a frame with normalized column names
+    and stripped string values.
 
-        column_map = {x: x.lower().replace(" ", "_") for x in curr_df.columns}
-        curr_df = curr_df.rename(columns=column_map)
-        curr_df = curr_df.rename(
-            columns={"meddra_preferred_terms": "medra_preferred_terms"}
-        )
-        curr_df = curr_df.applymap(strip_str)
+    Args:
+        path (Path): Path of a raw CAERS_ASCII_*.csv file.
+
+    Returns:
+        [pd.DataFrame]: Cleaned reports of the file.
+    """
+    return normalize_raw_frame(pd.read_csv(path, encoding="unicode_escape"))
+
+
+def read_raw_files(paths, jobs=1):
+    """Reads all raw files and concatenates them once, in the order of paths.
+
+    Args:
+        paths (list): Paths of raw CAERS files.
+        jobs (int, optional): Number of worker processes used to parse files, at most
+            the number of CPUs. Defaults to 1.
+
+    Returns:
+        [pd.DataFrame]: Reports of all files.
+    """
+    assert isinstance(jobs, int) and jobs > 0, "Check whether jobs is a positive int."
+    assert len(paths) > 0, "Atleast 1 raw file must be present"
+
+    jobs = min(jobs, len(paths), os.cpu_count() or 1)
+    if jobs == 1:
+        frames = [read_raw_file(p) for p in paths]
+    else:
+        # Executor.map yields results in submission order, so the row order
+        # is the same as for the serial path.
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            frames = list(pool.map(read_raw_file, paths))
+
+    return pd.concat(frames)
+
+
+def clean_reports(aggReports):
+    """Renames the category column and parses the report creation date.
 
-        aggReports = curr_df if aggReports is None else pd.concat([aggReports, curr_df])
+    Args:
+        aggReports (pd.DataFrame): Normalized raw reports.
 
+    Returns:
+        [pd.DataFrame]: Clean reports.
+    """
     aggReports = aggReports.rename(columns={"description": "category"})
     aggReports["caers_created_date"] = pd.to_datetime(aggReports.caers_created_date)
-    aggReports.reset_index(drop=True, inplace=True)
-    aggReports.to_csv(outPath / "clean_data.csv")
+    return aggReports
+
 
-    logger.info("Processing and enriching data")
+def enrich_reports(aggReports, brand_cache=None, quarantine_path=None):
+    """Adds the brand column and converts patient ages to year(s). Reports with
+    an unknown age unit are dropped and appended to quarantine_path.
+
+    Args:
+        aggReports (pd.DataFrame): Clean reports.
+        brand_cache (dict, optional): Persistent brand cache. Defaults to None.
+        quarantine_path (Path, optional): csv collecting the dropped reports. Defaults to None.
+
+    Returns:
+        [tuple]: (processed reports without the age_units column, brand name of
+        every clean report, patient age of every clean report in year(s), mask of
+        the clean reports with an unknown age unit)
+    """
+    logger = logging.getLogger(__name__)
 
     # Create brand-enriched column.
     logger.info("Making brand name column from clean data")
-    aggReports["brand"] = aggReports.apply(brand_preprocess, axis=1)
+    brands = memoized_extract_brands(
+        aggReports["product"], aggReports["category"], cache=brand_cache
+    )
 
     # Pre-processing Age column.
     logger.info("Converting age to a common unit year(s)")
-    aggReports["patient_age"] = aggReports.apply(age_preprocess, axis=1)
-    aggReports = aggReports.drop(columns=["age_units"])
+    years, unknown = convert_ages(aggReports["patient_age"], aggReports["age_units"])
+    processed = combine_reports(aggReports, brands, years, unknown, quarantine_path)
+    return processed, brands, years, unknown
 
-    aggReports.to_csv(outPath / "processed_data.csv")
 
-    # Create exploded outcome-wise cleaned data.
-    logger.info("Making outcomes exploded data set from clean brand-name data")
-    aggReports.outcomes = aggReports.outcomes.apply(
-        lambda x: [y.strip() for y in x.split(",") if y != []]
-    )
-    expl_aggReports = aggReports.explode("outcomes")
-    expl_aggReports = expl_aggReports.reset_index(drop=True)
-    expl_aggReports.to_csv(outPath / "exploded_data.csv")
+def combine_reports(aggReports, brands, years, unknown, quarantine_path=None):
+    """Adds brand names and ages in year(s) to the clean reports. Reports with an
+    unknown age unit are dropped and appended to quarantine_path.
 
-    # Create time-stamp processed & exploded data.
-    aggReports_time = aggReports.drop_duplicates(
-        ["report_id", "patient_age", "category", "sex"], ignore_index=True
-    )
+    Args:
+        aggReports (pd.DataFrame): Clean reports.
+        brands (pd.Series): Brand name of every report.
+        years (pd.Series): Patient age of every report in year(s).
+        unknown (pd.Series): Mask of the reports with an unknown age unit.
+        quarantine_path (Path, optional): csv collecting the dropped reports. Defaults to None.
+
+    Returns:
+        [pd.DataFrame]: Processed reports without the age_units column.
+    """
+    aggReports = aggReports.assign(brand=brands)
+    if unknown.any():
+        logging.getLogger(__name__).warning(
+            "Quarantining %d report(s) with unknown age units: %s",
+            unknown.sum(),
+            sorted(aggReports.loc[unknown, "age_units"].unique()),
+        )
+        if quarantine_path is not None:
+            aggReports[unknown].drop(columns=["brand"]).to_csv(
+                quarantine_path,
+                mode="a",
+                header=not quarantine_path.exists(),
+                index=False,
+            )
+        aggReports = aggReports[~unknown].copy()
+        years = years[~unknown]
+
+    aggReports["patient_age"] = years
+    return aggReports.drop(columns=["age_units"])
+
+
+def split_outcomes(outcomes):
+    """Splits every distinct comma-joined outcomes value once into stripped items.
+    Reports share few distinct combinations of outcomes, so this is much cheaper
+    than splitting the value of every report.
+
+    Reports without outcomes get the single item NaN, as DataFrame.explode gives
+    for a missing list.
+
+    Args:
+        outcomes (pd.Series): Comma-joined outcomes of the processed reports.
+
+    Returns:
+        [tuple]: (code of every report, list of items of every distinct value)
+    """
+    codes, uniques = pd.factorize(outcomes.values)
+    values = [[y.strip() for y in x.split(",")] for x in uniques]
+    # factorize codes missing values as -1, which would index the last value.
+    missing = codes < 0
+    if missing.any():
+        codes[missing] = len(values)
+        values.append([np.nan])
+    return codes, values
+
+
+def explode_outcomes(codes, values):
+    """Maps every report to its outcome items with array operations only. The
+    mapping is shared by both exploded outputs.
+
+    Args:
+        codes (np.ndarray): Code of every report, as given by split_outcomes.
+        values (list): List of items of every code.
+
+    Returns:
+        [tuple]: (report position of every item, item of every entry)
+    """
+    value_lengths = np.array([len(x) for x in values], dtype=np.int64)
+    value_starts = np.cumsum(value_lengths) - value_lengths
+    value_items = np.array(list(chain.from_iterable(values)), dtype=object)
+
+    lengths = value_lengths[codes]
+    positions = np.repeat(np.arange(len(codes)), lengths)
+    # Rank of every entry within its report, added to the start of its value.
+    ranks = np.arange(len(positions)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    items = value_items[np.repeat(value_starts[codes], lengths) + ranks]
+    return positions, items
+
+
+def select_outcomes(positions, items, rows, n_reports):
+    """Restricts the outcome mapping to some reports, numbered in the order of rows.
+
+    Args:
+        positions (np.ndarray): Report position of every item.
+        items (np.ndarray): Item of every entry.
+        rows (np.ndarray): Increasing positions of the selected reports.
+        n_reports (int): Number of reports of the mapping.
+
+    Returns:
+        [tuple]: (position in rows of every selected item, selected items)
+    """
+    lookup = np.full(n_reports, -1, dtype=np.int64)
+    lookup[rows] = np.arange(len(rows))
+    selected = lookup[positions]
+    keep = selected >= 0
+    return selected[keep], items[keep]
+
+
+def explode_reports(aggReports, positions, items):
+    """Creates one row per report outcome from the outcome mapping.
+
+    Args:
+        aggReports (pd.DataFrame): Processed reports.
+        positions (np.ndarray): Report position of every item.
+        items (np.ndarray): Item of every entry.
+
+    Returns:
+        [pd.DataFrame]: Outcome exploded reports.
+    """
+    expl_aggReports = aggReports.take(positions)
+    expl_aggReports["outcomes"] = items
+    return expl_aggReports.reset_index(drop=True)
+
+
+def time_reports(aggReports_time):
+    """Adds the year column and renames the creation date to time_stamp.
+
+    Args:
+        aggReports_time (pd.DataFrame): Reports deduplicated on TIME_KEYS.
+
+    Returns:
+        [pd.DataFrame]: Time-stamp reports.
+    """
     aggReports_time["year"] = aggReports_time["caers_created_date"].apply(
         lambda x: x.year
     )
-    aggReports_time = aggReports_time.rename(
-        columns={"caers_created_date": "time_stamp"}
+    return aggReports_time.rename(columns={"caers_created_date": "time_stamp"})
+
+
+def explode_time_reports(aggReports_time, positions, items):
+    """Creates one row per time-stamp report outcome, blank and missing outcomes
+    being marked as "Not Specified".
+
+    Args:
+        aggReports_time (pd.DataFrame): Time-stamp reports.
+        positions (np.ndarray): Time-stamp report position of every item.
+        items (np.ndarray): Item of every entry.
+
+    Returns:
+        [pd.DataFrame]: Outcome exploded time-stamp reports.
+    """
+    return explode_reports(
+        aggReports_time,
+        positions,
+        np.where(pd.isna(items) | (items == ""), "Not Specified", items),
+    )
+
+
+def time_outcome_reports(aggReports, codes, values, time_rows):
+    """Selects the time-stamp reports, with their outcomes as lists of items.
+
+    Args:
+        aggReports (pd.DataFrame): Processed reports.
+        codes (np.ndarray): Outcomes code of every report, as given by split_outcomes.
+        values (list): List of items of every code.
+        time_rows (np.ndarray): Increasing positions of the time-stamp reports.
+
+    Returns:
+        [pd.DataFrame]: Time-stamp reports.
+    """
+    aggReports_time = aggReports.iloc[time_rows].reset_index(drop=True)
+    aggReports_time["outcomes"] = [list(values[c]) for c in codes[time_rows]]
+    return time_reports(aggReports_time)
+
+
+def outcome_outputs(aggReports, time_rows):
+    """Derives the exploded, time-stamp and exploded time-stamp reports from a single
+    split and explode of the outcomes.
+
+    Args:
+        aggReports (pd.DataFrame): Processed reports with comma-joined outcomes.
+        time_rows (np.ndarray): Increasing positions of the time-stamp reports.
+
+    Returns:
+        [tuple]: (exploded reports, time-stamp reports, exploded time-stamp reports)
+    """
+    codes, values = split_outcomes(aggReports["outcomes"])
+    positions, items = explode_outcomes(codes, values)
+    expl_aggReports = explode_reports(aggReports, positions, items)
+
+    time_positions, time_items = select_outcomes(
+        positions, items, time_rows, len(aggReports)
+    )
+    aggReports_time = time_outcome_reports(aggReports, codes, values, time_rows)
+    expl_aggReports_time = explode_time_reports(
+        aggReports_time, time_positions, time_items
+    )
+    return expl_aggReports, aggReports_time, expl_aggReports_time
+
+
+def estimate_chunksize(path, max_memory, sample_rows=1000):
+    """Estimates how many raw rows can be streamed at once within a memory budget.
+
+    Args:
+        path (Path): Raw file used to sample the in-memory size of a row.
+        max_memory (int): Memory budget in MB.
+        sample_rows (int, optional): Number of rows sampled. Defaults to 1000.
+
+    Returns:
+        [int]: Number of raw rows per chunk.
+    """
+    assert (
+        isinstance(max_memory, int) and max_memory > 0
+    ), "Check whether max_memory is a positive int."
+    sample = normalize_raw_frame(
+        pd.read_csv(path, encoding="unicode_escape", nrows=sample_rows)
     )
-    aggReports_time.to_csv(outPath / "clean_data_time.csv")
+    row_bytes = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    return max(1, int(max_memory * 2 ** 20 / (row_bytes * STREAM_MEMORY_FACTOR)))
+
+
+def iter_raw_chunks(paths, chunksize):
+    """Yields normalized raw reports of all files, chunksize rows at a time.
+
+    Args:
+        paths (list): Paths of raw CAERS files.
+        chunksize (int): Maximum number of rows per chunk. None yields whole files.
+
+    Yields:
+        [pd.DataFrame]: Normalized raw reports.
+    """
+    for p in paths:
+        if chunksize is None:
+            yield read_raw_file(p)
+            continue
+        for chunk in pd.read_csv(p, encoding="unicode_escape", chunksize=chunksize):
+            yield normalize_raw_frame(chunk)
+
+
+def append_csv(df, path, offset):
+    """Appends df, cast to the declared SCHEMA, to the csv at path, numbering its
+    rows from offset. The file is created with a header when offset is 0.
+
+    Args:
+        df (pd.DataFrame): Rows to be written.
+        path (Path): Output csv file.
+        offset (int): Number of rows already written to path.
+
+    Returns:
+        [int]: Number of rows in path after writing.
+    """
+    df = apply_schema(df)
+    df.index = pd.RangeIndex(offset, offset + len(df))
+    df.to_csv(path, mode="w" if offset == 0 else "a", header=offset == 0)
+    return offset + len(df)
+
+
+def append_output(df, outPath, name, offset, formats=("csv",)):
+    """Appends df to the output name in every requested format: a csv file and/or
+    a year/category partitioned data set of the columnar store.
+
+    Args:
+        df (pd.DataFrame): Rows to be written.
+        outPath (Path): Output directory.
+        name (str): Output file name, one of OUTPUT_FILES.
+        offset (int): Number of rows already written to the output.
+        formats (list, optional): Output formats, "csv" and/or "parquet". Defaults to ("csv",).
+
+    Returns:
+        [int]: Number of rows in the output after writing.
+    """
+    if "csv" in formats:
+        append_csv(df, outPath / name, offset)
+    if "parquet" in formats:
+        root = outPath / COLUMNAR_DIR / Path(name).stem
+        if offset == 0:
+            remove_partitioned(root)
+        write_partitioned(apply_schema(df), root, offset)
+    return offset + len(df)
 
-    expl_aggReports_time = aggReports_time.explode("outcomes")
-    expl_aggReports_time["outcomes"] = expl_aggReports_time["outcomes"].str.strip()
-    expl_aggReports_time.loc[
-        expl_aggReports_time["outcomes"] == "", "outcomes"
-    ] = "Not Specified"
-    expl_aggReports_time = expl_aggReports_time.reset_index(drop=True)
-    expl_aggReports_time.to_csv(outPath / "exploded_data_time.csv")
 
+def report_keys(df):
+    """Hashes the TIME_KEYS of every report. Values are hashed in their text form
+    so that keys of freshly parsed reports match keys read back from the outputs.
+
+    Args:
+        df (pd.DataFrame): Reports with TIME_KEYS columns.
+
+    Returns:
+        [pd.Series]: uint64 hash per report.
+    """
+    return pd.util.hash_pandas_object(df[TIME_KEYS].astype(str), index=False)
+
+
+def stream_reports(
+    paths,
+    outPath,
+    chunksize,
+    offsets=None,
+    seen_keys=None,
+    brand_cache=None,
+    formats=("csv",),
+    metrics=None,
+    cubes=None,
+    star_builder=None,
+):
+    """Runs the whole pipeline chunk by chunk, appending every chunk to the outputs,
+    so that memory use is bounded by chunksize rather than by the input size.
+    The outputs are the same as the in-memory pipeline. Every step is measured
+    over all chunks: ingest, clean, enrich (brands and ages), outcomes, cube and star.
+
+    Args:
+        paths (list): Paths of raw CAERS files.
+        outPath (Path): Output directory.
+        chunksize (int): Maximum number of raw rows held in memory.
+        offsets (dict, optional): Rows already present in every output. Defaults to None (new outputs).
+        seen_keys (set, optional): report_keys of the existing time-stamp reports. Defaults to None.
+        brand_cache (dict, optional): Persistent brand cache. Defaults to None.
+        formats (list, optional): Output formats, "csv" and/or "parquet". Defaults to ("csv",).
+        metrics (dict, optional): Metrics of every step, updated in place. Defaults to None.
+        cubes (dict, optional): CUBE_OUTPUTS cube per name, None for an empty cube,
+            to which the counts of every chunk are added in place. Defaults to None (no cubes).
+        star_builder (StarBuilder, optional): Star schema to which every chunk is
+            added. Defaults to None (no star schema).
+
+    Returns:
+        [dict]: Number of rows of every output.
+    """
+    offsets = dict.fromkeys(OUTPUT_FILES, 0) if offsets is None else dict(offsets)
+    seen_keys = set() if seen_keys is None else seen_keys
+    metrics = {} if metrics is None else metrics
+    enrich = partial(
+        enrich_reports,
+        brand_cache=brand_cache,
+        quarantine_path=outPath / QUARANTINE_FILE,
+    )
+
+    def write(step, df, name):
+        offsets[name] = measure_step(
+            metrics,
+            step,
+            append_output,
+            df,
+            outPath,
+            name,
+            offsets[name],
+            formats,
+            write=True,
+        )
+
+    def count(cube, reports, dimensions, blank):
+        return add_cube(cube, as_loaded(reports, formats), dimensions, blank)
+
+    chunks = iter_raw_chunks(paths, chunksize)
+    while True:
+        chunk = measure_step(metrics, "ingest", next, chunks, None)
+        if chunk is None:
+            break
+        clean = measure_step(metrics, "clean", clean_reports, chunk)
+        write("clean", clean, "clean_data.csv")
+        chunk, brands, years, unknown = measure_step(metrics, "enrich", enrich, clean)
+        write("enrich", chunk, "processed_data.csv")
+
+        # Keep only the first report of every TIME_KEYS combination across chunks.
+        time_rows = np.flatnonzero(~chunk.duplicated(TIME_KEYS).values)
+        keys = report_keys(chunk.iloc[time_rows])
+        is_new = ~keys.isin(seen_keys)
+        seen_keys.update(keys[is_new])
+        expl_chunk, chunk_time, expl_chunk_time = measure_step(
+            metrics, "outcomes", outcome_outputs, chunk, time_rows[is_new.values]
+        )
+
+        write("outcomes", expl_chunk, "exploded_data.csv")
+        write("outcomes", chunk_time, "clean_data_time.csv")
+        write("outcomes", expl_chunk_time, "exploded_data_time.csv")
+
+        if cubes is not None:
+            sources = {"processed_data": chunk, "clean_data_time": chunk_time}
+            for name, (source, blank, dimensions) in CUBE_OUTPUTS.items():
+                cubes[name] = measure_step(
+                    metrics,
+                    "cube",
+                    count,
+                    cubes[name],
+                    sources[source],
+                    dimensions,
+                    blank,
+                )
+
+        if star_builder is not None:
+            processed = ~np.asarray(unknown)
+            time_reports = np.zeros(len(clean), dtype=bool)
+            time_reports[np.flatnonzero(processed)[time_rows[is_new.values]]] = True
+            measure_step(
+                metrics,
+                "star",
+                star_builder.add,
+                as_loaded(clean, formats),
+                brands,
+                years,
+                processed,
+                time_reports,
+            )
+
+    return offsets
+
+
+def file_digest(path):
+    """Computes the sha256 content hash of a file.
+
+    Args:
+        path (Path): File to be hashed.
+
+    Returns:
+        [str]: Hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def output_exists(outPath, name, formats=("csv",)):
+    """Checks whether an output was written in every requested format.
+
+    Args:
+        outPath (Path): Output directory.
+        name (str): Output file name, e.g. "clean_data.csv".
+        formats (list, optional): Output formats. Defaults to ("csv",).
+
+    Returns:
+        [bool]: True when the output exists in every format.
+    """
+    if "csv" in formats and not (outPath / name).exists():
+        return False
+    if "parquet" in formats and not (outPath / COLUMNAR_DIR / Path(name).stem).exists():
+        return False
+    return True
+
+
+def load_manifest(outPath, formats=("csv",)):
+    """Loads the raw-file manifest of an output directory.
+
+    Args:
+        outPath (Path): Output directory.
+        formats (list, optional): Output formats of the current run. Defaults to ("csv",).
+
+    Returns:
+        [dict]: The manifest, or None when missing, when the outputs were written in
+        other formats or when an output is missing.
+    """
+    path = outPath / MANIFEST_FILE
+    if not path.exists():
+        return None
+    manifest = json.loads(path.read_text())
+    if manifest.get("formats", ["csv"]) != list(formats):
+        return None
+    if not all(output_exists(outPath, n, formats) for n in OUTPUT_FILES):
+        return None
+    return manifest
+
+
+def scan_raw_files(paths, manifest):
+    """Fingerprints raw files, only hashing files whose size or mtime differ
+    from the manifest.
+
+    Args:
+        paths (list): Paths of raw CAERS files.
+        manifest (dict): Previous manifest, or None.
+
+    Returns:
+        [tuple]: (fingerprint per file name, paths of new files, names of changed or removed files)
+    """
+    known = {} if manifest is None else manifest["files"]
+    files = {}
+    new_paths = []
+    changed = []
+
+    for p in paths:
+        stat = p.stat()
+        entry = known.get(p.name)
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+        ):
+            files[p.name] = entry
+            continue
+
+        files[p.name] = {
+            "sha256": file_digest(p),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
+        if entry is None:
+            new_paths.append(p)
+        elif entry["sha256"] != files[p.name]["sha256"]:
+            changed.append(p.name)
+
+    changed += [name for name in known if name not in files]
+    return files, new_paths, changed
+
+
+def write_manifest(outPath, files, offsets, formats=("csv",)):
+    """Writes the raw-file manifest along with the row count of every output.
+
+    Args:
+        outPath (Path): Output directory.
+        files (dict): Fingerprint per raw file name.
+        offsets (dict): Number of rows of every output.
+        formats (list, optional): Output formats. Defaults to ("csv",).
+    """
+    manifest = {"files": files, "outputs": offsets, "formats": list(formats)}
+    (outPath / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def update_reports(
+    paths,
+    outPath,
+    manifest,
+    chunksize=None,
+    brand_cache=None,
+    formats=("csv",),
+    metrics=None,
+    cubes=None,
+    star_builder=None,
+):
+    """Appends the rows of new raw files to existing outputs. Time-stamp reports
+    already present in the outputs are not added again.
+
+    Args:
+        paths (list): Paths of the new raw files.
+        outPath (Path): Output directory.
+        manifest (dict): Manifest of the existing outputs.
+        chunksize (int, optional): Maximum number of raw rows held in memory. Defaults to None (whole files).
+        brand_cache (dict, optional): Persistent brand cache. Defaults to None.
+        formats (list, optional): Output formats, "csv" and/or "parquet". Defaults to ("csv",).
+        metrics (dict, optional): Metrics of every step, updated in place. Defaults to None.
+        cubes (dict, optional): Cubes of the existing outputs, as given by load_cubes,
+            to which the counts of the new rows are added in place. Defaults to None (no cubes).
+        star_builder (StarBuilder, optional): Star schema of the existing outputs, as
+            given by open_star, to which the new reports are added. Defaults to None.
+
+    Returns:
+        [dict]: Number of rows of every output.
+    """
+    if "csv" in formats:
+        existing = pd.read_csv(outPath / "clean_data_time.csv", usecols=TIME_KEYS)
+    else:
+        existing = read_partitioned(
+            outPath / COLUMNAR_DIR / "clean_data_time", columns=TIME_KEYS
+        )
+    seen_keys = set(report_keys(existing))
+    return stream_reports(
+        paths,
+        outPath,
+        chunksize,
+        offsets=manifest["outputs"],
+        seen_keys=seen_keys,
+        brand_cache=brand_cache,
+        formats=formats,
+        metrics=metrics,
+        cubes=cubes,
+        star_builder=star_builder,
+    )
+
+
+def load_output(outPath, name, formats=("csv",)):
+    """Reads an output back from the csv file or, without csv, from the columnar store.
+
+    Args:
+        outPath (Path): Output directory.
+        name (str): Output name without extension, e.g. "exploded_data".
+        formats (list, optional): Formats the outputs were written in. Defaults to ("csv",).
+
+    Returns:
+        [pd.DataFrame]: Typed data.
+    """
+    if "csv" in formats:
+        return read_processed(outPath / ("%s.csv" % name))
+    return read_partitioned(outPath / COLUMNAR_DIR / name)
+
+
+def as_loaded(df, formats=("csv",)):
+    """Gives df the missing values that load_output reads back from the outputs,
+    e.g. empty or "NA" strings of a csv file, so that cubes of chunks add up to
+    the cubes of the whole outputs.
+
+    Args:
+        df (pd.DataFrame): Rows as appended to the outputs.
+        formats (list, optional): Formats the outputs are written in. Defaults to ("csv",).
+
+    Returns:
+        [pd.DataFrame]: df with the values read back as missing set to NaN.
+    """
+    if "csv" not in formats:
+        return df
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if df[col].dtype == object and not is_list_column(df[col]):
+            df[col] = df[col].where(~df[col].isin(STR_NA_VALUES))
+    return df
+
+
+def write_cube_outputs(outPath, formats=("csv",)):
+    """Writes the CUBE_OUTPUTS count cubes of the report-grain outputs.
+
+    Args:
+        outPath (Path): Output directory.
+        formats (list, optional): Formats the outputs were written in. Defaults to ("csv",).
+    """
+    for name, (source, blank, dimensions) in CUBE_OUTPUTS.items():
+        cube = build_cube(load_output(outPath, source, formats), dimensions, blank)
+        append_output(cube, outPath, "%s.csv" % name, 0, formats)
+
+
+def load_cubes(outPath, offsets, formats=("csv",)):
+    """Reads back the CUBE_OUTPUTS count cubes, so that the counts of new rows can
+    be added to them. A cube counts every row of its report-grain output once in
+    its reports measure, which tells whether it covers the existing outputs.
+
+    Args:
+        outPath (Path): Output directory.
+        offsets (dict): Number of rows of every output, as recorded in the manifest.
+        formats (list, optional): Formats the outputs were written in. Defaults to ("csv",).
+
+    Returns:
+        [dict]: Cube per name, or None when a cube is missing or out of date.
+    """
+    cubes = {}
+    for name, (source, _, _) in CUBE_OUTPUTS.items():
+        if not output_exists(outPath, "%s.csv" % name, formats):
+            return None
+        cubes[name] = load_output(outPath, name, formats)
+        if cubes[name]["reports"].sum() != offsets["%s.csv" % source]:
+            return None
+    return cubes
+
+
+def write_cubes(cubes, outPath, formats=("csv",)):
+    """Writes count cubes built chunk by chunk.
+
+    Args:
+        cubes (dict): Cube per CUBE_OUTPUTS name.
+        outPath (Path): Output directory.
+        formats (list, optional): Output formats, "csv" and/or "parquet". Defaults to ("csv",).
+    """
+    for name, cube in cubes.items():
+        if cube is not None:
+            append_output(cube, outPath, "%s.csv" % name, 0, formats)
+
+
+def write_mmap_outputs(outPath, formats=("csv",)):
+    """Writes the MMAP_OUTPUTS data sets to the memory-mapped store.
+
+    Args:
+        outPath (Path): Output directory.
+        formats (list, optional): Formats the outputs were written in. Defaults to ("csv",).
+    """
+    for name in MMAP_OUTPUTS:
+        write_column_store(
+            load_output(outPath, name, formats), outPath / MMAP_DIR / name
+        )
+
+
+def star_is_current(outPath, offsets):
+    """Checks whether the star schema has a fact_report row per row of clean_data.
+
+    Args:
+        outPath (Path): Output directory.
+        offsets (dict): Number of rows of every output, as recorded in the manifest.
+
+    Returns:
+        [bool]: False when the schema is missing or out of date.
+    """
+    path = outPath / STAR_DIR / "fact_report.csv"
+    if not path.exists():
+        return False
+    with open(path) as f:
+        return sum(1 for _ in f) - 1 == offsets["clean_data.csv"]
+
+
+def open_star(outPath, offsets, chunksize=None):
+    """Opens the star schema of the outputs, so that new reports can be added to it.
+
+    Args:
+        outPath (Path): Output directory.
+        offsets (dict): Number of rows of every output, as recorded in the manifest.
+        chunksize (int, optional): Maximum number of rows held in memory. Defaults to None.
+
+    Returns:
+        [StarBuilder]: The schema, or None when it is missing or out of date.
+    """
+    if not star_is_current(outPath, offsets):
+        return None
+    return StarBuilder(outPath / STAR_DIR, chunksize, resume=True)
+
+
+def write_star_outputs(outPath, formats=("csv",), brand_cache=None):
+    """Writes the star schema of the outputs: dimension tables plus integer fact
+    tables at report and report-item grain, from which the legacy data sets can be
+    reconstructed with star_schema.legacy_view.
+
+    Args:
+        outPath (Path): Output directory.
+        formats (list, optional): Formats the outputs were written in. Defaults to ("csv",).
+        brand_cache (dict, optional): Persistent brand cache. Defaults to None.
+    """
+    clean = load_output(outPath, "clean_data", formats)
+    brands = memoized_extract_brands(
+        clean["product"].astype(object),
+        clean["category"].astype(object),
+        cache=brand_cache,
+    )
+    years, unknown = convert_ages(
+        clean["patient_age"], clean["age_units"].astype(object)
+    )
+    processed = ~unknown.values
+
+    # First report of every TIME_KEYS combination among the processed reports.
+    keys = clean[processed].assign(patient_age=years[processed])
+    time_reports = np.zeros(len(clean), dtype=bool)
+    time_reports[np.flatnonzero(processed)] = ~keys.duplicated(TIME_KEYS).values
+
+    tables = build_star(clean, brands, years, processed, time_reports)
+    write_star(tables, outPath / STAR_DIR)
+
+
+def output_paths(name, formats=("csv",)):
+    """Gets the paths written for an output in every requested format.
+
+    Args:
+        name (str): Output file name, e.g. "clean_data.csv".
+        formats (list, optional): Output formats. Defaults to ("csv",).
+
+    Returns:
+        [list]: paths relative to the output directory.
+    """
+    paths = [name] if "csv" in formats else []
+    if "parquet" in formats:
+        paths.append("%s/%s" % (COLUMNAR_DIR, Path(name).stem))
+    return paths
+
+
+def write_stage_output(context, df, name):
+    """Writes the result of a stage to an output in the formats of the run. Bound
+    to an output name with functools.partial, it is the write of a Stage.
+
+    Args:
+        context (dict): Run settings of the stages.
+        df (pd.DataFrame): Rows to be written.
+        name (str): Output file name, one of OUTPUT_FILES.
+    """
+    append_output(df, context["outPath"], name, 0, context["formats"])
+
+
+def ingest_stage(context):
+    """Reads and normalizes the raw CAERS files.
+
+    Args:
+        context (dict): Run settings of the stages.
+
+    Returns:
+        [pd.DataFrame]: Unified raw reports.
+    """
+    logging.getLogger(__name__).info("Creating clean unified data from raw files")
+    return read_raw_files(context["paths"], jobs=context["jobs"])
+
+
+def clean_stage(context, raw):
+    """Makes the clean reports of clean_data.csv.
+
+    Args:
+        context (dict): Run settings of the stages.
+        raw (pd.DataFrame): Result of the ingest stage.
+
+    Returns:
+        [pd.DataFrame]: Clean reports.
+    """
+    aggReports = clean_reports(raw).reset_index(drop=True)
+    return aggReports
+
+
+def brand_stage(context, clean):
+    """Derives the brand name of every clean report.
+
+    Args:
+        context (dict): Run settings of the stages.
+        clean (pd.DataFrame): Result of the clean stage.
+
+    Returns:
+        [pd.Series]: brand name of every report.
+    """
+    logging.getLogger(__name__).info("Making brand name column from clean data")
+    return memoized_extract_brands(
+        clean["product"], clean["category"], cache=context["brand_cache"]
+    )
+
+
+def age_stage(context, clean):
+    """Converts the patient age of every clean report to year(s).
+
+    Args:
+        context (dict): Run settings of the stages.
+        clean (pd.DataFrame): Result of the clean stage.
+
+    Returns:
+        [tuple]: (ages in year(s), mask of the rows whose unit is not in AGE_CONV)
+    """
+    logging.getLogger(__name__).info("Converting age to a common unit year(s)")
+    return convert_ages(clean["patient_age"], clean["age_units"])
+
+
+def processed_stage(context, clean, brands, ages):
+    """Makes the processed reports of processed_data.csv. Reports quarantined for
+    their age unit are written to QUARANTINE_FILE.
+
+    Args:
+        context (dict): Run settings of the stages.
+        clean (pd.DataFrame): Result of the clean stage.
+        brands (pd.Series): Result of the brand stage.
+        ages (tuple): Result of the age stage.
+
+    Returns:
+        [pd.DataFrame]: Processed reports.
+    """
+    quarantine_path = context["outPath"] / QUARANTINE_FILE
+    if quarantine_path.exists():
+        quarantine_path.unlink()
+    years, unknown = ages
+    aggReports = combine_reports(clean, brands, years, unknown, quarantine_path)
+    return aggReports
+
+
+def outcomes_stage(context, processed):
+    """Maps every processed report to its outcome items.
+
+    Args:
+        context (dict): Run settings of the stages.
+        processed (pd.DataFrame): Result of the processed stage.
+
+    Returns:
+        [tuple]: (outcomes code of every report, items of every code,
+        report position of every item, item of every entry)
+    """
+    logging.getLogger(__name__).info(
+        "Making outcomes exploded data set from clean brand-name data"
+    )
+    codes, values = split_outcomes(processed["outcomes"])
+    positions, items = explode_outcomes(codes, values)
+    return codes, values, positions, items
+
+
+def explode_stage(context, processed, outcomes):
+    """Makes the outcome exploded reports of exploded_data.csv.
+
+    Args:
+        context (dict): Run settings of the stages.
+        processed (pd.DataFrame): Result of the processed stage.
+        outcomes (tuple): Result of the outcomes stage.
+
+    Returns:
+        [pd.DataFrame]: Outcome exploded reports.
+    """
+    _, _, positions, items = outcomes
+    expl_aggReports = explode_reports(processed, positions, items)
+    return expl_aggReports
+
+
+def time_dedup_stage(context, processed, outcomes):
+    """Selects the first report of every TIME_KEYS combination and its outcomes.
+
+    Args:
+        context (dict): Run settings of the stages.
+        processed (pd.DataFrame): Result of the processed stage.
+        outcomes (tuple): Result of the outcomes stage.
+
+    Returns:
+        [tuple]: (positions of the time-stamp reports, time-stamp report
+        position of every selected item, selected items)
+    """
+    _, _, positions, items = outcomes
+    time_rows = np.flatnonzero(~processed.duplicated(TIME_KEYS).values)
+    time_positions, time_items = select_outcomes(
+        positions, items, time_rows, len(processed)
+    )
+    return time_rows, time_positions, time_items
+
+
+def time_stage(context, processed, outcomes, time_dedup):
+    """Makes the time-stamp reports of clean_data_time.csv.
+
+    Args:
+        context (dict): Run settings of the stages.
+        processed (pd.DataFrame): Result of the processed stage.
+        outcomes (tuple): Result of the outcomes stage.
+        time_dedup (tuple): Result of the time_dedup stage.
+
+    Returns:
+        [pd.DataFrame]: Time-stamp reports.
+    """
+    codes, values, _, _ = outcomes
+    aggReports_time = time_outcome_reports(processed, codes, values, time_dedup[0])
+    return aggReports_time
+
+
+def time_explode_stage(context, time, time_dedup):
+    """Makes the exploded time-stamp reports of exploded_data_time.csv.
+
+    Args:
+        context (dict): Run settings of the stages.
+        time (pd.DataFrame): Result of the time stage.
+        time_dedup (tuple): Result of the time_dedup stage.
+
+    Returns:
+        [pd.DataFrame]: Outcome exploded time-stamp reports.
+    """
+    _, time_positions, time_items = time_dedup
+    return explode_time_reports(time, time_positions, time_items)
+
+
+def cube_stage(context):
+    """Writes the count cubes from the processed and time-stamp outputs.
+
+    Args:
+        context (dict): Run settings of the stages.
+    """
+    logging.getLogger(__name__).info("Writing count cubes")
+    write_cube_outputs(context["outPath"], context["formats"])
+
+
+def mmap_stage(context):
+    """Writes the memory-mapped column store from the outputs.
+
+    Args:
+        context (dict): Run settings of the stages.
+    """
+    logging.getLogger(__name__).info("Writing memory-mapped column store")
+    write_mmap_outputs(context["outPath"], context["formats"])
+
+
+def star_stage(context):
+    """Writes the star schema from the clean output.
+
+    Args:
+        context (dict): Run settings of the stages.
+    """
+    logging.getLogger(__name__).info("Writing star schema")
+    write_star_outputs(context["outPath"], context["formats"], context["brand_cache"])
+
+
+def pipeline_stages(files, formats=("csv",), cube=True, mmap=False, star=False):
+    """Declares the stages of the in-memory pipeline, from the raw files to the
+    outputs. Stage keys cover the content of the raw files, the code of every
+    stage and of the helpers it calls, and the output formats.
+
+    Args:
+        files (dict): Fingerprint per raw file name, as given by scan_raw_files.
+        formats (list, optional): Output formats, "csv" and/or "parquet". Defaults to ("csv",).
+        cube (bool, optional): Write the count cubes. Defaults to True.
+        mmap (bool, optional): Write the memory-mapped column store. Defaults to False.
+        star (bool, optional): Write the star schema. Defaults to False.
+
+    Returns:
+        [list]: Stages in topological order.
+    """
+    writer = code_version(
+        write_stage_output, append_output, append_csv, apply_schema, SCHEMA, formats
+    )
+    raw = {name: f["sha256"] for name, f in files.items()}
+    stages = [
+        Stage(
+            "ingest",
+            ingest_stage,
+            version=code_version(
+                read_raw_files,
+                read_raw_file,
+                normalize_raw_frame,
+                strip_columns,
+                strip_str,
+                raw,
+            ),
+        ),
+        Stage(
+            "clean",
+            clean_stage,
+            ["ingest"],
+            output_paths("clean_data.csv", formats),
+            code_version(clean_reports) + writer,
+            write=partial(write_stage_output, name="clean_data.csv"),
+        ),
+        Stage("brand", brand_stage, ["clean"], version=brand_rules_version()),
+        Stage(
+            "age", age_stage, ["clean"], version=code_version(convert_ages, AGE_CONV),
+        ),
+        Stage(
+            "processed",
+            processed_stage,
+            ["clean", "brand", "age"],
+            output_paths("processed_data.csv", formats),
+            code_version(combine_reports) + writer,
+            write=partial(write_stage_output, name="processed_data.csv"),
+        ),
+        Stage(
+            "outcomes",
+            outcomes_stage,
+            ["processed"],
+            version=code_version(split_outcomes, explode_outcomes),
+        ),
+        Stage(
+            "explode",
+            explode_stage,
+            ["processed", "outcomes"],
+            output_paths("exploded_data.csv", formats),
+            code_version(explode_reports) + writer,
+            write=partial(write_stage_output, name="exploded_data.csv"),
+        ),
+        Stage(
+            "time_dedup",
+            time_dedup_stage,
+            ["processed", "outcomes"],
+            version=code_version(select_outcomes, TIME_KEYS),
+        ),
+        Stage(
+            "time",
+            time_stage,
+            ["processed", "outcomes", "time_dedup"],
+            output_paths("clean_data_time.csv", formats),
+            code_version(time_outcome_reports, time_reports) + writer,
+            write=partial(write_stage_output, name="clean_data_time.csv"),
+        ),
+        Stage(
+            "time_explode",
+            time_explode_stage,
+            ["time", "time_dedup"],
+            output_paths("exploded_data_time.csv", formats),
+            code_version(explode_time_reports, explode_reports) + writer,
+            write=partial(write_stage_output, name="exploded_data_time.csv"),
+        ),
+    ]
+
+    if cube:
+        stages.append(
+            Stage(
+                "cube",
+                cube_stage,
+                isolated=True,
+                outputs=sum(
+                    [output_paths("%s.csv" % n, formats) for n in CUBE_OUTPUTS], []
+                ),
+                version=code_version(write_cube_outputs, build_cube, CUBE_OUTPUTS)
+                + writer,
+                after=["processed", "time"],
+            )
+        )
+    if mmap:
+        stages.append(
+            Stage(
+                "mmap",
+                mmap_stage,
+                isolated=True,
+                outputs=[MMAP_DIR],
+                version=code_version(write_mmap_outputs, write_column_store),
+                after=["processed", "time"],
+            )
+        )
+    if star:
+        stages.append(
+            Stage(
+                "star",
+                star_stage,
+                isolated=True,
+                outputs=[STAR_DIR],
+                version=code_version(write_star_outputs, build_star, write_star)
+                + brand_rules_version(),
+                after=["clean"],
+            )
+        )
+    return stages
+
+
+def save_metrics(outPath, metrics, run, started, **settings):
+    """Logs the metrics of a run and writes them to METRICS_DIR/<run>.json, with the
+    wall time and the peak resident memory of the whole run.
+
+    Args:
+        outPath (Path): Output directory.
+        metrics (list): Metrics of every stage, as given by pipeline.run_stages.
+        run (str): Name of the run, e.g. its start time.
+        started (float): time.perf_counter() at the start of the run.
+        settings: Settings of the run, e.g. jobs or formats.
+    """
+    log_metrics(metrics)
+    write_metrics(
+        outPath / METRICS_DIR / ("%s.json" % run),
+        metrics,
+        run=run,
+        wall_s=time.perf_counter() - started,
+        peak_rss_mb=peak_rss_mb(),
+        **settings
+    )
+
+
+def build_reports(
+    stages,
+    paths,
+    outPath,
+    jobs=1,
+    brand_cache=None,
+    formats=("csv",),
+    profile=False,
+    **selection
+):
+    """Runs the stages of the in-memory pipeline that are not up to date in the
+    stage cache of the output directory. The metrics of the run are logged and
+    written to METRICS_DIR/<run>.json, the cProfile stats of every stage to
+    METRICS_DIR/<run>/ with profile.
+
+    Args:
+        stages (list): Stages as given by pipeline_stages.
+        paths (list): Paths of raw CAERS files.
+        outPath (Path): Output directory.
+        jobs (int, optional): Number of worker processes used to parse files and of
+            concurrent stages and output writes. Defaults to 1.
+        brand_cache (dict, optional): Persistent brand cache. Defaults to None.
+        formats (list, optional): Output formats, "csv" and/or "parquet". Defaults to ("csv",).
+        profile (bool, optional): Dump the cProfile stats of every stage. Defaults to False.
+        selection: only and/or start stage names, as for pipeline.run_stages.
+
+    Returns:
+        [dict]: Number of rows of every output, None when some output never ran.
+    """
+    context = {
+        "paths": paths,
+        "outPath": outPath,
+        "jobs": jobs,
+        "brand_cache": brand_cache,
+        "formats": formats,
+    }
+    run = time.strftime("%Y%m%d-%H%M%S")
+    started = time.perf_counter()
+    cache = StageCache(outPath)
+    metrics = run_stages(
+        stages,
+        context,
+        cache,
+        workers=jobs,
+        profile_dir=outPath / METRICS_DIR / run if profile else None,
+        **selection
+    )
+
+    save_metrics(
+        outPath, metrics, run, started, jobs=jobs, formats=list(formats), **selection
+    )
+
+    offsets = {name: cache.rows(stage) for name, stage in OUTPUT_STAGES.items()}
+    return None if None in offsets.values() else offsets
+
+
+@click.command()
+@click.argument("input_dirpath", type=click.Path(exists=True))
+@click.argument("output_dirpath", type=click.Path())
+@click.option(
+    "--jobs",
+    default=1,
+    type=int,
+    help="Number of processes parsing raw files, and of concurrent pipeline "
+    "stages and output writes.",
+)
+@click.option(
+    "--max-memory",
+    default=None,
+    type=int,
+    help="Memory budget in MB. Streams raw files in chunks fitting the budget.",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only process raw files that are new since the last run.",
+)
+@click.option(
+    "--format",
+    "output_format",
+    default="csv",
+    type=click.Choice(list(OUTPUT_FORMATS)),
+    help="Write csv files, a year/category partitioned parquet store, or both.",
+)
+@click.option(
+    "--cube/--no-cube",
+    default=True,
+    help="Write the count cubes used by the plots. Enabled by default.",
+)
+@click.option(
+    "--mmap",
+    is_flag=True,
+    help="Also write the report data sets to a memory-mapped column store. "
+    "Not available with --max-memory.",
+)
+@click.option(
+    "--star",
+    is_flag=True,
+    help="Also write a star schema of dimension and integer fact tables.",
+)
+@click.option(
+    "--only",
+    default=None,
+    type=click.Choice(STAGE_NAMES),
+    help="Run a single stage of the pipeline from the cached results of its inputs.",
+)
+@click.option(
+    "--from",
+    "start",
+    default=None,
+    type=click.Choice(STAGE_NAMES),
+    help="Rerun a stage and every stage depending on it, even when up to date.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Also dump the cProfile stats of every pipeline stage next to its metrics.",
+)
+def main(
+    input_dirpath="../../data/raw/",
+    output_dirpath="../../data/processed",
+    jobs=1,
+    max_memory=None,
+    incremental=False,
+    output_format="csv",
+    cube=True,
+    mmap=False,
+    star=False,
+    only=None,
+    start=None,
+    profile=False,
+):
+    """ Runs data processing scripts to turn raw data from (../raw) into
+        cleaned data ready to be analyzed (saved in ../processed).
+    """
+    outPath = Path(output_dirpath)
+    inPath = Path(input_dirpath)
+    paths = sorted(inPath.glob("*.csv"))
+
+    logger = logging.getLogger(__name__)
+
+    formats = OUTPUT_FORMATS[output_format]
+    if "parquet" in formats:
+        check_parquet_engine()
+
+    if only is not None and start is not None:
+        raise click.UsageError("--only and --from cannot be combined.")
+    if (only or start or profile) and (incremental or max_memory is not None):
+        raise click.UsageError(
+            "--only, --from and --profile run the in-memory pipeline, "
+            "without --incremental or --max-memory."
+        )
+    if mmap and max_memory is not None:
+        # The column store sorts the dictionaries of whole columns in memory.
+        raise click.UsageError("--mmap cannot be combined with --max-memory.")
+
+    chunksize = None
+    if max_memory is not None:
+        chunksize = estimate_chunksize(paths[0], max_memory)
+        logger.info("Streaming raw files in chunks of %d rows", chunksize)
+
+    brand_cache = load_brand_cache(outPath / BRAND_CACHE_FILE)
+    manifest = load_manifest(outPath, formats) if incremental else None
+    # Steps of streaming and incremental runs, measured over all chunks.
+    metrics = {}
+    run = time.strftime("%Y%m%d-%H%M%S")
+    started = time.perf_counter()
+    files, new_paths, changed = scan_raw_files(paths, manifest)
+
+    if manifest is not None and not changed:
+        if not new_paths:
+            logger.info("Processed data is up to date")
+            if cube and load_cubes(outPath, manifest["outputs"], formats) is None:
+                if max_memory is None:
+                    write_cube_outputs(outPath, formats)
+                else:
+                    logger.warning(
+                        "Count cubes are missing or out of date. "
+                        "Run once without --max-memory to rebuild them."
+                    )
+            if mmap and not (outPath / MMAP_DIR).exists():
+                write_mmap_outputs(outPath, formats)
+            if star and not star_is_current(outPath, manifest["outputs"]):
+                if max_memory is None:
+                    write_star_outputs(outPath, formats, brand_cache)
+                else:
+                    logger.warning(
+                        "Star schema is missing or out of date. "
+                        "Run once without --max-memory to rebuild it."
+                    )
+            return
+        logger.info("Processing %d new raw file(s)", len(new_paths))
+        cubes = load_cubes(outPath, manifest["outputs"], formats) if cube else None
+        star_builder = (
+            open_star(outPath, manifest["outputs"], chunksize) if star else None
+        )
+        offsets = update_reports(
+            new_paths,
+            outPath,
+            manifest,
+            chunksize,
+            brand_cache=brand_cache,
+            formats=formats,
+            metrics=metrics,
+            cubes=cubes,
+            star_builder=star_builder,
+        )
+    elif chunksize is None:
+        if changed:
+            logger.info("Raw files changed or removed, rebuilding: %s", changed)
+        stages = pipeline_stages(files, formats, cube=cube, mmap=mmap, star=star)
+        selected = only or start
+        if selected is not None and selected not in [s.name for s in stages]:
+            raise click.UsageError(
+                "Stage %s is disabled by the options of this run." % selected
+            )
+        offsets = build_reports(
+            stages,
+            paths,
+            outPath,
+            jobs=jobs,
+            brand_cache=brand_cache,
+            formats=formats,
+            profile=profile,
+            only=only,
+            start=start,
+        )
+        save_brand_cache(outPath / BRAND_CACHE_FILE, brand_cache)
+        if offsets is not None:
+            write_manifest(outPath, files, offsets, formats)
+        logger.info("Data cleaning and pre-processing done!")
+        return
+    else:
+        if changed:
+            logger.info("Raw files changed or removed, rebuilding: %s", changed)
+        if (outPath / QUARANTINE_FILE).exists():
+            (outPath / QUARANTINE_FILE).unlink()
+        cubes = dict.fromkeys(CUBE_OUTPUTS) if cube else None
+        star_builder = StarBuilder(outPath / STAR_DIR, chunksize) if star else None
+        offsets = stream_reports(
+            paths,
+            outPath,
+            chunksize,
+            brand_cache=brand_cache,
+            formats=formats,
+            metrics=metrics,
+            cubes=cubes,
+            star_builder=star_builder,
+        )
+
+    save_brand_cache(outPath / BRAND_CACHE_FILE, brand_cache)
+    write_manifest(outPath, files, offsets, formats)
+
+    if cubes is not None:
+        logger.info("Writing count cubes")
+        measure_step(metrics, "cube", write_cubes, cubes, outPath, formats, write=True)
+    elif cube and max_memory is None:
+        logger.info("Count cubes are missing or out of date, rebuilding them")
+        measure_step(metrics, "cube", write_cube_outputs, outPath, formats)
+    elif cube:
+        # Rebuilding would read whole outputs back, beyond the memory budget.
+        logger.warning(
+            "Count cubes are missing or out of date, removing them. "
+            "Run once without --max-memory to rebuild them."
+        )
+        for name in CUBE_OUTPUTS:
+            if (outPath / ("%s.csv" % name)).exists():
+                (outPath / ("%s.csv" % name)).unlink()
+            remove_partitioned(outPath / COLUMNAR_DIR / name)
+
+    if mmap:
+        logger.info("Writing memory-mapped column store")
+        measure_step(metrics, "mmap", write_mmap_outputs, outPath, formats)
+
+    if star_builder is not None:
+        logger.info("Writing star schema")
+        measure_step(metrics, "star", star_builder.close, write=True)
+    elif star and max_memory is None:
+        logger.info("Star schema is missing or out of date, rebuilding it")
+        measure_step(metrics, "star", write_star_outputs, outPath, formats, brand_cache)
+    elif star:
+        logger.warning(
+            "Star schema is missing or out of date, removing it. "
+            "Run once without --max-memory to rebuild it."
+        )
+        if (outPath / STAR_DIR).exists():
+            shutil.rmtree(outPath / STAR_DIR)
+
+    save_metrics(
+        outPath,
+        [dict(stage=name, **m) for name, m in metrics.items()],
+        run,
+        started,
+        jobs=jobs,
+        formats=list(formats),
+        max_memory=max_memory,
+        incremental=incremental,
+    )
     logger.info("Data cleaning and pre-processing done!")
 
 
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+import json
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from multivalue import (
+    MULTIVALUED_COLUMNS,
+    MultiValued,
+    encode_multivalued,
+    explode_positions,
+    join_items,
+)
+from schema import apply_schema
+
+# Directory of the memory-mapped store inside the processed data directory.
+MMAP_DIR = "mmap"
+
+# Report-grain data sets written to the memory-mapped store. Their outcome
+# exploded views are derived on demand with ColumnStore.explode.
+MMAP_OUTPUTS = ["processed_data", "clean_data_time"]
+
+
+def code_dtype(n_values):
+    """Gets the smallest signed integer type holding codes of n_values values and -1.
+
+    Args:
+        n_values (int): Size of the dictionary.
+
+    Returns:
+        [np.dtype]: int8, int16, int32 or int64.
+    """
+    for dtype in [np.int8, np.int16, np.int32]:
+        if n_values <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def write_column_store(df, root):
+    """Writes df as one fixed-width .npy array per column. Strings and categoricals
+    are stored as integer codes (-1 for missing) plus a json dictionary, datetimes as
+    int64 nanoseconds and numbers as is. MULTIVALUED_COLUMNS are stored in CSR form:
+    offsets and codes arrays plus a json dictionary of the items. The store is
+    written next to root and moved in place, so readers never see a partial store.
+
+    Args:
+        df (pd.DataFrame): Processed CAERS data.
+        root (Path): Directory of the store.
+    """
+    assert isinstance(df, pd.DataFrame), "Check whether df is Pandas Dataframe or not."
+
+    root = Path(root)
+    tmp = root.with_name(root.name + ".tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+
+    df = apply_schema(df)
+    meta = {"rows": len(df), "columns": {}}
+
+    for col in df.columns:
+        values = df[col]
+        if col in MULTIVALUED_COLUMNS:
+            mv = encode_multivalued(values)
+            np.save(tmp / ("%s.offsets.npy" % col), mv.offsets)
+            np.save(tmp / ("%s.codes.npy" % col), mv.codes)
+            (tmp / ("%s.dict.json" % col)).write_text(json.dumps(mv.dictionary))
+            meta["columns"][col] = {"kind": "multivalued", "dtype": str(mv.codes.dtype)}
+            continue
+
+        if pd.api.types.is_datetime64_any_dtype(values):
+            kind = "datetime"
+            array = values.values.view(np.int64)
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(
+            values
+        ):
+            kind = "numeric"
+            array = values.values
+        else:
+            kind = "codes"
+            codes, uniques = pd.factorize(values.astype(object), sort=True)
+            array = codes.astype(code_dtype(len(uniques)))
+            (tmp / ("%s.dict.json" % col)).write_text(
+                json.dumps([str(x) for x in uniques])
+            )
+
+        np.save(tmp / ("%s.npy" % col), np.ascontiguousarray(array))
+        meta["columns"][col] = {"kind": kind, "dtype": str(array.dtype)}
+
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+    if root.exists():
+        shutil.rmtree(root)
+    tmp.rename(root)
+
+
+class ColumnStore:
+    """Read-only view of a store written by write_column_store. Arrays are memory
+    mapped on first access, so opening the store only reads meta.json and processes
+    opening the same store share its pages through the OS page cache.
+
+    Args:
+        root (Path): Directory of the store.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        meta = json.loads((self.root / "meta.json").read_text())
+        self.rows = meta["rows"]
+        self.columns = meta["columns"]
+        self._arrays = {}
+        self._dictionaries = {}
+        self._codes = {}
+
+    def __len__(self):
+        return self.rows
+
+    def array(self, col):
+        """Gets the memory-mapped array of a column: codes, int64 nanoseconds or numbers.
+
+        Args:
+            col (str): Column name.
+
+        Returns:
+            [np.ndarray]: read-only memory-mapped array.
+        """
+        if col not in self._arrays:
+            self._arrays[col] = np.load(self.root / ("%s.npy" % col), mmap_mode="r")
+        return self._arrays[col]
+
+    def dictionary(self, col):
+        """Gets the values of the codes of a coded column.
+
+        Args:
+            col (str): Column name.
+
+        Returns:
+            [list]: value of every code.
+        """
+        kind = self.columns[col]["kind"]
+        assert kind in ["codes", "multivalued"], "%s is not a coded column" % col
+        if col not in self._dictionaries:
+            path = self.root / ("%s.dict.json" % col)
+            self._dictionaries[col] = json.loads(path.read_text())
+        return self._dictionaries[col]
+
+    def code(self, col, value):
+        """Gets the code of a value of a coded column.
+
+        Args:
+            col (str): Column name.
+            value (str): Value to be looked up.
+
+        Returns:
+            [int]: code of value, -1 when the value does not occur.
+        """
+        if col not in self._codes:
+            self._codes[col] = {v: i for i, v in enumerate(self.dictionary(col))}
+        return self._codes[col].get(value, -1)
+
+    def multivalued(self, col):
+        """Gets the CSR arrays of a multi-valued column.
+
+        Args:
+            col (str): Column name, one of MULTIVALUED_COLUMNS.
+
+        Returns:
+            [MultiValued]: memory-mapped offsets and codes and the item dictionary.
+        """
+        assert self.columns[col]["kind"] == "multivalued", (
+            "%s is not a multi-valued column" % col
+        )
+        return MultiValued(
+            self.array("%s.offsets" % col),
+            self.array("%s.codes" % col),
+            self.dictionary(col),
+        )
+
+    def explode(self, col, columns=None, blank=None):
+        """Derives the exploded view of the store over a multi-valued column: one row
+        per report item, like DataFrame.explode after splitting col on commas.
+
+        Args:
+            col (str): Multi-valued column to be exploded.
+            columns (list, optional): Other columns of the view. Defaults to None (all columns).
+            blank (str, optional): Replacement of empty items, e.g. "Not Specified". Defaults to None.
+
+        Returns:
+            [pd.DataFrame]: exploded data.
+        """
+        columns = list(self.columns) if columns is None else columns
+        rows, codes = explode_positions(self.multivalued(col))
+
+        # Replacing empty items may merge them with an existing item.
+        dictionary = np.array(self.dictionary(col), dtype=object)
+        if blank is not None:
+            dictionary[dictionary == ""] = blank
+        categories, remap = np.unique(dictionary.astype(str), return_inverse=True)
+        if len(categories):
+            codes = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+
+        df = pd.DataFrame(index=pd.RangeIndex(len(rows)))
+        for c in columns:
+            if c == col:
+                df[c] = pd.Categorical.from_codes(codes, categories=categories)
+            else:
+                df[c] = self.series(c).iloc[rows].values
+        return df
+
+    def series(self, col):
+        """Decodes a column into a pandas Series. Coded columns become categoricals
+        over the memory-mapped codes and multi-valued columns comma-joined strings.
+
+        Args:
+            col (str): Column name.
+
+        Returns:
+            [pd.Series]: column values.
+        """
+        kind = self.columns[col]["kind"]
+        if kind == "multivalued":
+            return pd.Series(join_items(self.multivalued(col)), name=col, dtype=object)
+
+        array = self.array(col)
+        if kind == "codes":
+            values = pd.Categorical.from_codes(array, categories=self.dictionary(col))
+        elif kind == "datetime":
+            # NaT is stored as the smallest int64, like in datetime64 arrays.
+            values = array.view("datetime64[ns]")
+        else:
+            values = array
+        return pd.Series(values, name=col)
+
+    def to_frame(self, columns=None):
+        """Decodes columns of the store into a DataFrame.
+
+        Args:
+            columns (list, optional): Columns to be decoded. Defaults to None (all columns).
+
+        Returns:
+            [pd.DataFrame]: decoded data.
+        """
+        columns = list(self.columns) if columns is None else columns
+        return pd.concat([self.series(c) for c in columns], axis=1)
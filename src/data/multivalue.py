@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import ast
+from collections import namedtuple
+from itertools import chain
+import numpy as np
+import pandas as pd
+
+# Comma-joined multi-valued columns, stored in CSR form in the column store.
+MULTIVALUED_COLUMNS = ["medra_preferred_terms", "outcomes"]
+
+# Items of report i are dictionary[codes[offsets[i]:offsets[i + 1]]].
+MultiValued = namedtuple("MultiValued", ["offsets", "codes", "dictionary"])
+
+
+def split_items(value, sep=","):
+    """Splits a value of a multi-valued column into its items. Values may be
+    comma-joined strings, lists, or list reprs as written to clean_data_time.csv.
+
+    Args:
+        value: Value of a multi-valued column.
+        sep (str, optional): Item separator. Defaults to ",".
+
+    Returns:
+        [list]: items of the value, none for missing values.
+    """
+    if isinstance(value, str):
+        return ast.literal_eval(value) if value.startswith("[") else value.split(sep)
+    if isinstance(value, (list, np.ndarray)):
+        return list(value)
+    return []
+
+
+def encode_multivalued(values, sep=","):
+    """Interns the stripped items of a multi-valued column into an integer dictionary
+    and stores the items of every value as an offsets array plus a codes array.
+
+    Args:
+        values (pd.Series): Multi-valued column.
+        sep (str, optional): Item separator. Defaults to ",".
+
+    Returns:
+        [MultiValued]: offsets (int64, one more than values), codes (int32) and
+        sorted dictionary of the items.
+    """
+    lists = [split_items(x, sep) for x in values]
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in lists], out=offsets[1:])
+
+    items = [str(x).strip() for x in chain.from_iterable(lists)]
+    codes, dictionary = pd.factorize(np.array(items, dtype=object), sort=True)
+    return MultiValued(offsets, codes.astype(np.int32), [str(x) for x in dictionary])
+
+
+def join_items(mv):
+    """Decodes every report back into a comma-joined string, joined the way the raw
+    data joins them: an empty last item leaves a trailing comma, e.g.
+    "Medically Important,". Reports without items were missing values.
+
+    Args:
+        mv (MultiValued): Encoded column.
+
+    Returns:
+        [list]: string of every report, None for missing values.
+    """
+    return [
+        ", ".join(mv.dictionary[c] for c in mv.codes[start:end]).rstrip(" ")
+        if end > start
+        else None
+        for start, end in zip(mv.offsets[:-1], mv.offsets[1:])
+    ]
+
+
+def row_lengths(mv):
+    """Gets the number of items of every report.
+
+    Args:
+        mv (MultiValued): Encoded column.
+
+    Returns:
+        [np.ndarray]: number of items per report.
+    """
+    return np.diff(mv.offsets)
+
+
+def count_items(mv, rows=None):
+    """Counts every item over the selected reports with a single bincount.
+
+    Args:
+        mv (MultiValued): Encoded column.
+        rows (np.ndarray, optional): Boolean mask over the reports. Defaults to None (all reports).
+
+    Returns:
+        [np.ndarray]: count of every dictionary item.
+    """
+    codes = mv.codes
+    if rows is not None:
+        codes = codes[np.repeat(rows, row_lengths(mv))]
+    return np.bincount(codes, minlength=len(mv.dictionary))
+
+
+def select_reports(mv, rows):
+    """Restricts an encoded column to some reports.
+
+    Args:
+        mv (MultiValued): Encoded column.
+        rows (np.ndarray): Boolean mask over the reports.
+
+    Returns:
+        [MultiValued]: items of the selected reports.
+    """
+    lengths = np.diff(mv.offsets)
+    offsets = np.zeros(int(rows.sum()) + 1, dtype=np.int64)
+    np.cumsum(lengths[rows], out=offsets[1:])
+    return MultiValued(offsets, mv.codes[np.repeat(rows, lengths)], mv.dictionary)
+
+
+def explode_positions(mv):
+    """Derives the exploded view of a column: one entry per report item. Like
+    DataFrame.explode, a report without items gives one entry with code -1.
+
+    Args:
+        mv (MultiValued): Encoded column.
+
+    Returns:
+        [tuple]: (report position of every entry, item code of every entry)
+    """
+    lengths = row_lengths(mv)
+    counts = np.maximum(lengths, 1)
+    rows = np.repeat(np.arange(len(lengths)), counts)
+
+    codes = np.full(len(rows), -1, dtype=np.int64)
+    has_items = np.repeat(lengths > 0, counts)
+    codes[has_items] = mv.codes
+    return rows, codes
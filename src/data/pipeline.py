@@ -0,0 +1,651 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Directory of the stage cache inside the processed data directory.
+STAGE_CACHE_DIR = "stage_cache"
+
+# Stage results are files named after their key, listed in this index with the
+# fingerprints of the outputs written by every stage.
+STAGE_INDEX_FILE = "index.json"
+
+# Directory of the per-run metrics files and cProfile stats.
+METRICS_DIR = "metrics"
+
+# Seconds between two samples of the resident memory of a measured call.
+RSS_SAMPLE_INTERVAL = 0.01
+
+# Columns of the stage summary logged at the end of a run.
+SUMMARY_COLUMNS = [
+    ("stage", "%-12s", "%-12s"),
+    ("status", "%-6s", "%-6s"),
+    ("wall_s", "%8s", "%8.2f"),
+    ("cpu_s", "%8s", "%8.2f"),
+    ("rows_in", "%9s", "%9d"),
+    ("rows_out", "%9s", "%9d"),
+    ("rows_per_s", "%10s", "%10.0f"),
+    ("peak_growth_mb", "%14s", "%14.0f"),
+    ("write_wall_s", "%12s", "%12.2f"),
+]
+
+# A pipeline step: func(context, *values of inputs) returns the stage result and
+# write(context, result), when given, writes it to outputs, paths relative to the
+# output directory. The stage key hashes the code of func, version (helper code and
+# parameters) and the keys of inputs and after, stages whose outputs the stage
+# reads from disk instead of from memory. Isolated stages take no inputs and may
+# run in a worker process, so changes they make to the context are not kept.
+Stage = namedtuple(
+    "Stage",
+    ["name", "func", "inputs", "outputs", "version", "after", "write", "isolated"],
+    defaults=[(), (), "", (), None, False],
+)
+
+
+def code_version(*objects):
+    """Fingerprints the source of functions and the value of constants.
+
+    Args:
+        objects: Functions or JSON serializable constants.
+
+    Returns:
+        [str]: Hex digest of the objects.
+    """
+    parts = [
+        inspect.getsource(o) if callable(o) else json.dumps(o, sort_keys=True)
+        for o in objects
+    ]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def stage_keys(stages):
+    """Computes the content address of every stage result.
+
+    Args:
+        stages (list): Stages in topological order.
+
+    Returns:
+        [dict]: key per stage name.
+    """
+    keys = {}
+    for stage in stages:
+        deps = list(stage.inputs) + list(stage.after)
+        payload = {
+            "name": stage.name,
+            "code": inspect.getsource(stage.func),
+            "version": stage.version,
+            "inputs": [keys[d] for d in deps],
+        }
+        keys[stage.name] = hashlib.sha256(
+            json.dumps(payload, sort_keys=True).encode()
+        ).hexdigest()
+    return keys
+
+
+def descendants(stages, name):
+    """Gets a stage and every stage depending on it, directly or not.
+
+    Args:
+        stages (list): Stages in topological order.
+        name (str): Stage name.
+
+    Returns:
+        [set]: names of the stage and of its descendants.
+    """
+    names = {name}
+    for stage in stages:
+        if names.intersection(stage.inputs) or names.intersection(stage.after):
+            names.add(stage.name)
+    return names
+
+
+def fingerprint(path):
+    """Fingerprints an output file or directory by its size and modification time.
+
+    Args:
+        path (Path): Output path.
+
+    Returns:
+        [list]: [size, mtime in ns], or None when path is missing.
+    """
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class StageCache:
+    """Content-addressed store of stage results, kept next to the outputs. A stage
+    is up to date when the index holds its current key and its outputs still have
+    the fingerprints recorded when it ran.
+
+    Args:
+        outPath (Path): Output directory.
+    """
+
+    def __init__(self, outPath):
+        self.outPath = outPath
+        self.root = outPath / STAGE_CACHE_DIR
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / STAGE_INDEX_FILE
+        self.index = json.loads(path.read_text()) if path.exists() else {}
+
+    def is_valid(self, stage, key, stored=False):
+        """Checks whether a stage ran with key and its outputs are unchanged.
+
+        Args:
+            stage (Stage): Stage to be checked.
+            key (str): Current key of the stage.
+            stored (bool, optional): Also require the stored result. Defaults to False.
+
+        Returns:
+            [bool]: True when the stage need not run.
+        """
+        record = self.index.get(stage.name)
+        if record is None or record["key"] != key:
+            return False
+        if stored and not (self.root / ("%s.pkl" % key)).exists():
+            return False
+        return all(
+            fingerprint(self.outPath / o) == record["outputs"].get(o)
+            for o in stage.outputs
+        )
+
+    def load(self, key):
+        """Reads a stored stage result.
+
+        Args:
+            key (str): Stage key.
+
+        Returns:
+            Stage result.
+        """
+        return pd.read_pickle(self.root / ("%s.pkl" % key))
+
+    def store(self, key, value):
+        """Stores a stage result for later runs.
+
+        Args:
+            key (str): Stage key.
+            value: Stage result.
+        """
+        pd.to_pickle(value, self.root / ("%s.pkl" % key))
+
+    def record(self, stage, key, value):
+        """Records that a stage ran, with the fingerprints of its outputs, and drops
+        the result stored under its previous key.
+
+        Args:
+            stage (Stage): Stage that ran.
+            key (str): Stage key.
+            value: Stage result.
+        """
+        previous = self.index.get(stage.name, {}).get("key")
+        if previous is not None and previous != key:
+            (self.root / ("%s.pkl" % previous)).unlink(missing_ok=True)
+
+        self.index[stage.name] = {
+            "key": key,
+            "outputs": {o: fingerprint(self.outPath / o) for o in stage.outputs},
+            "rows": len(value) if isinstance(value, pd.DataFrame) else None,
+        }
+        (self.root / STAGE_INDEX_FILE).write_text(
+            json.dumps(self.index, indent=2, sort_keys=True)
+        )
+
+    def rows(self, name):
+        """Gets the number of rows of the result of a stage when it last ran.
+
+        Args:
+            name (str): Stage name.
+
+        Returns:
+            [int]: Number of rows, None for unknown stages and non-frame results.
+        """
+        return self.index.get(name, {}).get("rows")
+
+
+def peak_rss_mb():
+    """Gets the peak resident memory of the current process.
+
+    Returns:
+        [float]: Peak resident memory in MB, None without the resource module.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere.
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def current_rss():
+    """Gets the resident memory of the current process, from psutil when it is
+    installed and from /proc otherwise.
+
+    Returns:
+        [int]: Resident memory in bytes, None when it cannot be read.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+class RssSampler:
+    """Samples the resident memory of the process on a thread while a call runs,
+    to get its own peak rather than the peak of the process so far. Calls running
+    side by side on threads share the process, so their peaks include each other's.
+
+    Args:
+        interval (float, optional): Seconds between two samples. Defaults to RSS_SAMPLE_INTERVAL.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.start = current_rss()
+        self.peak = self.start
+        self.stopped = threading.Event()
+        self.thread = None
+        if self.start is not None:
+            self.thread = threading.Thread(
+                target=self.sample, args=(interval,), daemon=True
+            )
+            self.thread.start()
+
+    def sample(self, interval):
+        while not self.stopped.wait(interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        """Stops sampling.
+
+        Returns:
+            [float]: Growth of the resident memory at its peak over its start in MB, None when it cannot be read.
+        """
+        if self.thread is None:
+            return None
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+        return (self.peak - self.start) / 2 ** 20
+
+
+def count_rows(value):
+    """Counts the rows of a stage result: the length of a frame, series or array,
+    or of the first element of a tuple like (ages, unknown).
+
+    Args:
+        value: Stage result.
+
+    Returns:
+        [int]: Number of rows, None for other results.
+    """
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+def measure(func, args, profile_path=None):
+    """Calls func, timing it on the wall clock and on the CPU clock of the calling
+    thread, so that stages running side by side on threads are told apart, and
+    sampling how much the resident memory grows while it runs.
+
+    Args:
+        func (function): Function to be called.
+        args (list): Arguments of func.
+        profile_path (Path, optional): File receiving the cProfile stats of the call. Defaults to None.
+
+    Returns:
+        [tuple]: (result of func, dict of wall_s, cpu_s and peak_growth_mb)
+    """
+    profiler = cProfile.Profile() if profile_path is not None else None
+    sampler = RssSampler()
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        value = func(*args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(str(profile_path))
+        wall = time.perf_counter() - start_wall
+        cpu = time.thread_time() - start_cpu
+        peak_growth = sampler.stop()
+    return value, {"wall_s": wall, "cpu_s": cpu, "peak_growth_mb": peak_growth}
+
+
+def compute_stage(stage, context, args, cache, key, store, profile_path=None):
+    """Runs the function of a stage and stores its result.
+
+    Args:
+        stage (Stage): Stage to be run.
+        context (dict): Run settings passed to the stage function.
+        args (list): Values of the stage inputs.
+        cache (StageCache): Stage cache of the output directory.
+        key (str): Stage key.
+        store (bool): Store the result for later runs.
+        profile_path (Path, optional): File receiving the cProfile stats of the stage. Defaults to None.
+
+    Returns:
+        [tuple]: (stage result, metrics as given by measure)
+    """
+    logging.getLogger(__name__).info("Running stage %s", stage.name)
+    value, metrics = measure(stage.func, [context] + list(args), profile_path)
+    if store:
+        cache.store(key, value)
+    return value, metrics
+
+
+def stage_metrics(args, value, metrics):
+    """Completes the metrics of a stage with its row counts and throughput.
+
+    Args:
+        args (list): Values of the stage inputs.
+        value: Stage result.
+        metrics (dict): Metrics as given by measure.
+
+    Returns:
+        [dict]: Metrics of the stage.
+    """
+    counts = [n for n in map(count_rows, args) if n is not None]
+    metrics = dict(metrics, status="ran")
+    metrics["rows_in"] = max(counts) if counts else None
+    metrics["rows_out"] = count_rows(value)
+    rows = metrics["rows_in"] if metrics["rows_in"] is not None else metrics["rows_out"]
+    metrics["rows_per_s"] = (
+        rows / metrics["wall_s"] if rows is not None and metrics["wall_s"] > 0 else None
+    )
+    return metrics
+
+
+def write_step_metrics(measured):
+    """Names the metrics of an output write after the stage writing it.
+
+    Args:
+        measured (dict): Metrics of the write, as given by measure.
+
+    Returns:
+        [dict]: write_wall_s, write_cpu_s and write_peak_growth_mb.
+    """
+    return {"write_%s" % name: value for name, value in measured.items()}
+
+
+def add_step_metrics(totals, name, metrics):
+    """Adds the metrics of one chunk of a streamed step to the totals of the step:
+    times and rows are summed and peaks are the largest of any chunk.
+
+    Args:
+        totals (dict): Metrics of every step, updated in place.
+        name (str): Step name.
+        metrics (dict): Metrics of the chunk, as given by stage_metrics or write_step_metrics.
+    """
+    total = totals.setdefault(name, {"status": "ran"})
+    for key, value in metrics.items():
+        if value is None or key in ["status", "rows_per_s"]:
+            continue
+        if key.endswith("peak_growth_mb"):
+            total[key] = max(total.get(key, value), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    rows = total.get("rows_in", total.get("rows_out"))
+    total["rows_per_s"] = (
+        rows / total["wall_s"] if rows is not None and total.get("wall_s") else None
+    )
+
+
+def measure_step(totals, name, func, *args, write=False):
+    """Calls func on one chunk of a streamed step and adds its metrics to the
+    totals of the step.
+
+    Args:
+        totals (dict): Metrics of every step, updated in place.
+        name (str): Step name.
+        func (function): Function to be called.
+        args: Arguments of func.
+        write (bool, optional): func writes the outputs of the step. Defaults to False.
+
+    Returns:
+        Result of func.
+    """
+    value, measured = measure(func, list(args))
+    if write:
+        add_step_metrics(totals, name, write_step_metrics(measured))
+    else:
+        add_step_metrics(totals, name, stage_metrics(args, value, measured))
+    return value
+
+
+def write_metrics(path, metrics, **run):
+    """Writes the metrics of a run to a JSON file.
+
+    Args:
+        path (Path): Metrics file.
+        metrics (list): Metrics of every stage, as given by run_stages.
+        run: Settings of the run, e.g. jobs or formats.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(dict(run, stages=metrics), indent=2))
+
+
+def log_metrics(metrics):
+    """Logs the metrics of a run as a table, one line per stage.
+
+    Args:
+        metrics (list): Metrics of every stage, as given by run_stages.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info(" ".join(header % name for name, header, _ in SUMMARY_COLUMNS))
+    for m in metrics:
+        logger.info(
+            " ".join(
+                (header % "-") if m.get(name) is None else (fmt % m[name])
+                for name, header, fmt in SUMMARY_COLUMNS
+            )
+        )
+
+
+def run_stages(
+    stages, context, cache, only=None, start=None, workers=1, profile_dir=None
+):
+    """Runs the stages that are not up to date in cache. Stage results needed by
+    later stages are kept in memory or read back from the cache.
+
+    With several workers, a stage starts as soon as its inputs are computed and the
+    outputs of its after stages are written: stage functions and output writes run
+    on a thread pool, which shares stage results instead of pickling them, and
+    isolated stages, which read their inputs from disk, on a process pool. Workers
+    are capped at the number of CPUs. Without, stages run one after the other in
+    order. Threads only overlap where pandas and numpy release the GIL, so pure
+    Python stages such as brand and age do not run faster side by side.
+
+    Every stage that runs is measured: wall and CPU time, input and output rows,
+    rows per second and the growth of the resident memory of the process running
+    it, which is shared by the stages running side by side on threads.
+
+    Args:
+        stages (list): Stages in topological order.
+        context (dict): Run settings passed to every stage function.
+        cache (StageCache): Stage cache of the output directory.
+        only (str, optional): Run this stage alone, from cached inputs. Defaults to None.
+        start (str, optional): Rerun this stage and every later stage depending on it. Defaults to None.
+        workers (int, optional): Number of concurrent stages and writes, at most the number of CPUs. Defaults to 1.
+        profile_dir (Path, optional): Directory receiving the cProfile stats of every stage and write. Defaults to None.
+
+    Returns:
+        [list]: metrics of every stage, in order. Stages that did not run have the status "cached".
+    """
+    logger = logging.getLogger(__name__)
+    keys = stage_keys(stages)
+    names = [s.name for s in stages]
+    for name in [only, start]:
+        if name is not None and name not in names:
+            raise ValueError("Stage %s is not part of this pipeline" % name)
+
+    # Results of stages with dependents are stored so that later runs can resume.
+    consumed = {i for s in stages for i in s.inputs}
+
+    if only is not None:
+        stage = stages[names.index(only)]
+        stale = [
+            i
+            for i in stage.inputs
+            if not cache.is_valid(stages[names.index(i)], keys[i], stored=True)
+        ]
+        if stale:
+            raise ValueError(
+                "Inputs of %s are not up to date: %s, run the pipeline first"
+                % (only, ", ".join(stale))
+            )
+        selected = {only}
+    else:
+        forced = descendants(stages, start) if start is not None else set()
+        selected = {
+            s.name
+            for s in stages
+            if s.name in forced
+            or not cache.is_valid(s, keys[s.name], stored=s.name in consumed)
+        }
+
+    metrics = {}
+    for stage in stages:
+        if stage.name not in selected:
+            logger.info("Stage %s is up to date", stage.name)
+            metrics[stage.name] = {"status": "cached"}
+
+    if profile_dir is not None:
+        profile_dir.mkdir(parents=True, exist_ok=True)
+
+    def profile_path(stage, step):
+        if profile_dir is None:
+            return None
+        return profile_dir / ("%s%s.prof" % (stage.name, step))
+
+    values = {}
+
+    def inputs(stage):
+        for i in stage.inputs:
+            if i not in values:
+                values[i] = cache.load(keys[i])
+        return [values[i] for i in stage.inputs]
+
+    if workers > (os.cpu_count() or 1):
+        workers = os.cpu_count() or 1
+        logger.info("Running at most %d stage(s) at a time, one per CPU", workers)
+
+    pending = [s for s in stages if s.name in selected]
+    if workers <= 1:
+        for stage in pending:
+            args = inputs(stage)
+            values[stage.name], measured = compute_stage(
+                stage,
+                context,
+                args,
+                cache,
+                keys[stage.name],
+                stage.name in consumed,
+                profile_path(stage, ""),
+            )
+            metrics[stage.name] = stage_metrics(args, values[stage.name], measured)
+            if stage.write is not None:
+                _, write = measure(
+                    stage.write,
+                    [context, values[stage.name]],
+                    profile_path(stage, ".write"),
+                )
+                metrics[stage.name].update(write_step_metrics(write))
+            cache.record(stage, keys[stage.name], values[stage.name])
+        return [dict(stage=n, **metrics[n]) for n in names]
+
+    # Stages whose result is available and stages whose outputs are written.
+    computed = set(names) - selected
+    finished = set(names) - selected
+    running = {}
+    stage_args = {}
+    # Worker processes are spawned rather than forked from this multi-threaded process.
+    with ThreadPoolExecutor(workers) as threads, ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn")
+    ) as processes:
+        while pending or running:
+            for stage in list(pending):
+                if not (
+                    computed.issuperset(stage.inputs)
+                    and finished.issuperset(stage.after)
+                ):
+                    continue
+                pending.remove(stage)
+                if stage.isolated:
+                    logger.info("Running stage %s in a worker process", stage.name)
+                    stage_args[stage.name] = []
+                    future = processes.submit(
+                        measure, stage.func, [context], profile_path(stage, "")
+                    )
+                else:
+                    stage_args[stage.name] = inputs(stage)
+                    future = threads.submit(
+                        compute_stage,
+                        stage,
+                        context,
+                        stage_args[stage.name],
+                        cache,
+                        keys[stage.name],
+                        stage.name in consumed,
+                        profile_path(stage, ""),
+                    )
+                running[future] = (stage, "compute")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, step = running.pop(future)
+                if step == "compute":
+                    values[stage.name], measured = future.result()
+                    metrics[stage.name] = stage_metrics(
+                        stage_args.pop(stage.name), values[stage.name], measured
+                    )
+                    computed.add(stage.name)
+                    if stage.write is not None:
+                        future = threads.submit(
+                            measure,
+                            stage.write,
+                            [context, values[stage.name]],
+                            profile_path(stage, ".write"),
+                        )
+                        running[future] = (stage, "write")
+                        continue
+                else:
+                    metrics[stage.name].update(write_step_metrics(future.result()[1]))
+                cache.record(stage, keys[stage.name], values[stage.name])
+                finished.add(stage.name)
+
+    return [dict(stage=n, **metrics[n]) for n in names]
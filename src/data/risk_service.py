@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+import click
+import heapq
+import json
+import logging
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import pandas as pd
+
+from cube import REDACTED_PRODUCT
+from make_dataset import extract_brands
+from multivalue import encode_multivalued
+from schema import read_processed
+
+# Serious outcomes, the relv_outcomes of the visualizations.
+SERIOUS_OUTCOMES = [
+    "Death",
+    "Life Threatening",
+    "Hospitalization",
+    "Disability",
+    "Patient Visited ER",
+]
+
+# Completions kept at every trie node, the largest autocomplete limit.
+MAX_COMPLETIONS = 10
+
+# Symptoms listed in the statistics of a name.
+TOP_SYMPTOMS = 10
+
+NAME_TYPES = ["brand", "product"]
+
+
+def normalize_name(name):
+    """Normalizes a product or brand name for lookups: upper case, single spaces.
+
+    Args:
+        name (str): Product or brand name.
+
+    Returns:
+        [str]: normalized name.
+    """
+    return " ".join(str(name).upper().split())
+
+
+class TrieNode:
+    """Node of a compressed trie. label is the text of the edge into the node."""
+
+    __slots__ = ["label", "children", "entries", "top"]
+
+    def __init__(self, label=""):
+        self.label = label
+        self.children = {}
+        self.entries = []
+        self.top = []
+
+
+class NameTrie:
+    """Compressed prefix trie over product and brand names. Every node keeps the
+    MAX_COMPLETIONS most reported names below it, so an autocomplete walks the
+    prefix and returns a precomputed list, whatever the number of matching names.
+
+    Args:
+        entries (list): (name, type, reports) of every name.
+    """
+
+    def __init__(self, entries):
+        self.root = TrieNode()
+        for name, kind, reports in entries:
+            self.insert(name).entries.append((-reports, name, kind))
+        self.rank()
+
+    def insert(self, key):
+        """Gets the node of key, adding it and splitting edges as needed.
+
+        Args:
+            key (str): Normalized name.
+
+        Returns:
+            [TrieNode]: node of key.
+        """
+        node = self.root
+        while key:
+            child = node.children.get(key[0])
+            if child is None:
+                child = node.children[key[0]] = TrieNode(key)
+                return child
+            common = 0
+            limit = min(len(key), len(child.label))
+            while common < limit and key[common] == child.label[common]:
+                common += 1
+            if common < len(child.label):
+                # Split the edge at the end of the common prefix.
+                middle = TrieNode(child.label[:common])
+                child.label = child.label[common:]
+                middle.children[child.label[0]] = child
+                node.children[key[0]] = middle
+                child = middle
+            key = key[common:]
+            node = child
+        return node
+
+    def rank(self):
+        """Stores the most reported names below every node, children first."""
+        nodes = []
+        pending = deque([self.root])
+        while pending:
+            node = pending.popleft()
+            nodes.append(node)
+            pending.extend(node.children.values())
+        for node in reversed(nodes):
+            candidates = list(node.entries)
+            for child in node.children.values():
+                candidates.extend(child.top)
+            node.top = heapq.nsmallest(MAX_COMPLETIONS, candidates)
+
+    def complete(self, prefix, limit=MAX_COMPLETIONS):
+        """Gets the most reported names starting with prefix.
+
+        Args:
+            prefix (str): Normalized prefix.
+            limit (int, optional): Number of names. Defaults to MAX_COMPLETIONS.
+
+        Returns:
+            [list]: (negated reports, name, type) of the names, most reported first.
+        """
+        node = self.root
+        while prefix:
+            child = node.children.get(prefix[0])
+            if child is None:
+                return []
+            if child.label.startswith(prefix):
+                return child.top[:limit]
+            if not prefix.startswith(child.label):
+                return []
+            prefix = prefix[len(child.label) :]
+            node = child
+        return node.top[:limit]
+
+
+def item_counts(name_codes, values):
+    """Counts the items of a multi-valued column per name, e.g. the outcomes of
+    every brand. Empty items are left out.
+
+    Args:
+        name_codes (np.ndarray): Name code of every report, -1 for missing names.
+        values (pd.Series): Multi-valued column of the reports.
+
+    Returns:
+        [dict]: name code to list of (item, count), most frequent first.
+    """
+    mv = encode_multivalued(values)
+    names = np.repeat(name_codes, np.diff(mv.offsets))
+    items = np.asarray(mv.codes, dtype=np.int64)
+    keep = (names >= 0) & (np.array(mv.dictionary, dtype=object)[items] != "")
+
+    n_items = max(len(mv.dictionary), 1)
+    pairs, counts = np.unique(names[keep] * n_items + items[keep], return_counts=True)
+    result = {}
+    for pair, count in zip(pairs.tolist(), counts.tolist()):
+        name, item = divmod(pair, n_items)
+        result.setdefault(name, []).append((mv.dictionary[item], count))
+    for name in result:
+        result[name].sort(key=lambda x: (-x[1], x[0]))
+    return result
+
+
+def serious_reports(values):
+    """Flags the reports with at least one of SERIOUS_OUTCOMES.
+
+    Args:
+        values (pd.Series): outcomes of the reports.
+
+    Returns:
+        [np.ndarray]: boolean flag of every report.
+    """
+    mv = encode_multivalued(values)
+    serious = np.isin(np.array(mv.dictionary, dtype=object), SERIOUS_OUTCOMES)
+    reports = np.repeat(np.arange(len(values)), np.diff(mv.offsets))
+    flags = np.bincount(reports, weights=serious[mv.codes], minlength=len(values))
+    return flags > 0
+
+
+def name_stats(names, reports, kind):
+    """Precomputes the statistics of every product or brand name.
+
+    Args:
+        names (pd.Series): Name of every report.
+        reports (pd.DataFrame): processed_data reports, aligned with names.
+        kind (str): "product" or "brand".
+
+    Returns:
+        [dict]: normalized name to statistics.
+    """
+    names = names.astype(object).map(normalize_name, na_action="ignore")
+    codes, uniques = pd.factorize(names.where(names != ""))
+    totals = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    serious = np.bincount(
+        codes[codes >= 0],
+        weights=serious_reports(reports["outcomes"])[codes >= 0],
+        minlength=len(uniques),
+    )
+    outcomes = item_counts(codes, reports["outcomes"])
+    symptoms = item_counts(codes, reports["medra_preferred_terms"])
+
+    return {
+        name: {
+            "name": name,
+            "type": kind,
+            "reports": int(totals[i]),
+            "serious_reports": int(serious[i]),
+            "outcomes": dict(outcomes.get(i, [])),
+            "top_symptoms": symptoms.get(i, [])[:TOP_SYMPTOMS],
+        }
+        for i, name in enumerate(uniques)
+    }
+
+
+def is_batch_item(item):
+    """Checks whether an item of a shopping list is a product name, or a dict with
+    a product name and an optional category name.
+
+    Args:
+        item: Item of a POST /batch request.
+
+    Returns:
+        [bool]: True when the item can be resolved.
+    """
+    if isinstance(item, str):
+        return True
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get("product"), str)
+        and isinstance(item.get("category", ""), (str, type(None)))
+    )
+
+
+class RiskService:
+    """Product risk lookups over processed_data: autocomplete of product and brand
+    names and their precomputed outcome and symptom statistics. Everything is
+    computed when the service starts, requests only read memory.
+
+    Redacted reports, whose product is REDACTED_PRODUCT, name no product and are
+    left out.
+
+    Args:
+        reports (pd.DataFrame): processed_data reports with product, brand, outcomes and medra_preferred_terms.
+    """
+
+    def __init__(self, reports):
+        assert isinstance(
+            reports, pd.DataFrame
+        ), "Check whether reports is Pandas Dataframe."
+        redacted = reports["product"].astype(object) == REDACTED_PRODUCT
+        reports = reports[~redacted.values].reset_index(drop=True)
+
+        self.stats = {
+            "brand": name_stats(reports["brand"], reports, "brand"),
+            "product": name_stats(reports["product"], reports, "product"),
+        }
+        # Responses are serialized once, a request only looks them up.
+        self.responses = {
+            kind: {name: json.dumps(s).encode() for name, s in stats.items()}
+            for kind, stats in self.stats.items()
+        }
+        self.trie = NameTrie(
+            (name, kind, s["reports"])
+            for kind, stats in self.stats.items()
+            for name, s in stats.items()
+        )
+        self.brand_risks = {
+            name: {
+                "reports": s["reports"],
+                "serious_reports": s["serious_reports"],
+                "serious_outcomes": {
+                    o: s["outcomes"][o] for o in SERIOUS_OUTCOMES if o in s["outcomes"]
+                },
+            }
+            for name, s in self.stats["brand"].items()
+        }
+
+    def autocomplete(self, prefix, limit=MAX_COMPLETIONS):
+        """Gets the most reported product and brand names starting with prefix.
+
+        Args:
+            prefix (str): Beginning of a product or brand name.
+            limit (int, optional): Number of names. Defaults to MAX_COMPLETIONS.
+
+        Returns:
+            [list]: name, type and reports of the matches.
+        """
+        assert (
+            isinstance(limit, int) and limit > 0
+        ), "Check whether limit is a positive int."
+        return [
+            {"name": name, "type": kind, "reports": -reports}
+            for reports, name, kind in self.trie.complete(normalize_name(prefix), limit)
+        ]
+
+    def batch(self, items):
+        """Resolves a shopping list of products to brands, with the brand rules of
+        make_dataset applied to the whole list at once, and gets the serious outcome
+        counts of every brand.
+
+        Args:
+            items (list): Product names, or dicts with a product and an optional category.
+
+        Returns:
+            [list]: product, brand and risks of every item, in the order of items.
+            Redacted products are not known.
+        """
+        assert isinstance(items, list) and all(
+            is_batch_item(x) for x in items
+        ), "Check whether items is a list of product names or product dicts."
+        items = [x if isinstance(x, dict) else {"product": x} for x in items]
+        products = pd.Series([x.get("product") for x in items], dtype=object)
+        categories = pd.Series([x.get("category") for x in items], dtype=object)
+        brands = extract_brands(products, categories)
+
+        results = []
+        for product, brand in zip(products, brands):
+            brand = None if pd.isna(brand) else normalize_name(brand)
+            # Redacted products are left out of the statistics, like in __init__.
+            risks = None
+            if normalize_name(product) != REDACTED_PRODUCT:
+                risks = self.brand_risks.get(brand)
+            result = {"product": product, "brand": brand, "known": risks is not None}
+            result.update(
+                risks or {"reports": 0, "serious_reports": 0, "serious_outcomes": {}}
+            )
+            results.append(result)
+        return results
+
+    def stats_response(self, name, kind=None):
+        """Gets the serialized statistics of a name.
+
+        Args:
+            name (str): Product or brand name.
+            kind (str, optional): "brand" or "product". Defaults to None (brand first).
+
+        Returns:
+            [bytes]: json statistics, None when the name is unknown.
+        """
+        name = normalize_name(name)
+        for k in NAME_TYPES if kind is None else [kind]:
+            if name in self.responses.get(k, {}):
+                return self.responses[k][name]
+        return None
+
+
+class RiskRequestHandler(BaseHTTPRequestHandler):
+    """Answers GET /autocomplete?q=PREFIX&limit=N, GET /stats?name=NAME&type=brand,
+    GET /health and POST /batch with a json body {"items": [...]} with json."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, Nagle would hold the body back.
+    disable_nagle_algorithm = True
+    service = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        status, body = 200, None
+        if url.path == "/autocomplete":
+            try:
+                limit = int(params.get("limit", MAX_COMPLETIONS))
+            except ValueError:
+                limit = None
+            if limit is None:
+                status, body = 400, json.dumps({"error": "limit must be an integer"})
+            else:
+                limit = max(1, min(limit, MAX_COMPLETIONS))
+                matches = self.service.autocomplete(params.get("q", ""), limit)
+                body = json.dumps({"query": params.get("q", ""), "matches": matches})
+        elif url.path == "/stats" and "name" in params:
+            body = self.service.stats_response(params["name"], params.get("type"))
+            if body is None:
+                status, body = 404, json.dumps({"error": "unknown name"})
+        elif url.path == "/health":
+            body = json.dumps({"status": "ok"})
+        else:
+            status, body = 404, json.dumps({"error": "not found"})
+
+        self.respond(status, body)
+
+    def do_POST(self):
+        status, body = 200, None
+        if urlsplit(self.path).path == "/batch":
+            try:
+                length = int(self.headers.get("Content-Length", ""))
+            except ValueError:
+                length = -1
+            items = None
+            if length >= 0:
+                try:
+                    items = json.loads(self.rfile.read(length) or b"{}").get("items")
+                except (ValueError, AttributeError):
+                    pass
+            if length < 0:
+                # The body cannot be skipped, so the connection is not reused.
+                self.close_connection = True
+                error = "Content-Length must be a non-negative integer"
+                status, body = 400, json.dumps({"error": error})
+            elif not isinstance(items, list):
+                status, body = 400, json.dumps({"error": 'expected {"items": [...]}'})
+            elif not all(is_batch_item(x) for x in items):
+                invalid = [i for i, x in enumerate(items) if not is_batch_item(x)]
+                error = "items must be product names or dicts with a product name"
+                status, body = 400, json.dumps({"error": error, "invalid": invalid})
+            else:
+                body = json.dumps({"results": self.service.batch(items)})
+        else:
+            status, body = 404, json.dumps({"error": "not found"})
+        self.respond(status, body)
+
+    def respond(self, status, body):
+        """Sends a json response.
+
+        Args:
+            status (int): HTTP status.
+            body (str): json body, str or bytes.
+        """
+        body = body if isinstance(body, bytes) else body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format, *args)
+
+
+def make_server(service, host="127.0.0.1", port=8000):
+    """Creates a threaded HTTP server answering with service.
+
+    Args:
+        service (RiskService): Loaded service.
+        host (str, optional): Interface to listen on. Defaults to "127.0.0.1".
+        port (int, optional): Port, 0 for any free port. Defaults to 8000.
+
+    Returns:
+        [ThreadingHTTPServer]: server, not yet serving.
+    """
+    handler = type("Handler", (RiskRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def load_service(processed_dirpath):
+    """Loads the service from the processed data directory.
+
+    Args:
+        processed_dirpath (Path): Directory of processed_data.csv.
+
+    Returns:
+        [RiskService]: loaded service.
+    """
+    columns = ["product", "brand", "outcomes", "medra_preferred_terms"]
+    reports = read_processed(Path(processed_dirpath) / "processed_data.csv", columns)
+    return RiskService(reports)
+
+
+@click.command()
+@click.argument("processed_dirpath", type=click.Path(exists=True))
+@click.option("--host", default="127.0.0.1", help="Interface to listen on.")
+@click.option("--port", default=8000, type=int, help="Port to listen on.")
+def main(processed_dirpath="../../data/processed", host="127.0.0.1", port=8000):
+    """ Serves product risk lookups over the processed data, fully offline.
+    """
+    logger = logging.getLogger(__name__)
+
+    service = load_service(processed_dirpath)
+    logger.info(
+        "Loaded %d brands and %d products",
+        len(service.stats["brand"]),
+        len(service.stats["product"]),
+    )
+    server = make_server(service, host, port)
+    logger.info("Serving on http://%s:%d", *server.server_address[:2])
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Declared types of the processed CAERS columns. Low-cardinality and identifier
+# columns are dictionary encoded as categoricals: report_id and product_code hold
+# values like "2018-CFS-000002" and "41G", so they get integer codes rather than
+# plain integers. patient_age keeps -1 for unknown ages.
+SCHEMA = {
+    "report_id": "category",
+    "caers_created_date": "datetime64[ns]",
+    "time_stamp": "datetime64[ns]",
+    "date_of_event": "datetime64[ns]",
+    "product_type": "category",
+    "product_code": "category",
+    "category": "category",
+    "patient_age": "float64",
+    "age_units": "category",
+    "sex": "category",
+    "outcomes": "category",
+    "brand": "category",
+    "year": "int16",
+    "month": "int8",
+}
+
+
+def is_list_column(col):
+    """Checks whether an object column holds lists, like the outcomes of the
+    time-stamp reports before they are exploded. Lists read back from parquet
+    are arrays.
+
+    Args:
+        col (pd.Series): Column to be checked.
+
+    Returns:
+        [bool]: True when the first non-null value is a list.
+    """
+    if col.dtype != object:
+        return False
+    values = col.dropna()
+    return len(values) > 0 and isinstance(values.iloc[0], (list, np.ndarray))
+
+
+def apply_schema(df):
+    """Casts the columns of df that are declared in SCHEMA. Dates that cannot be
+    parsed become NaT and are logged.
+
+    Args:
+        df (pd.DataFrame): Processed CAERS data.
+
+    Returns:
+        [pd.DataFrame]: Typed data.
+    """
+    assert isinstance(df, pd.DataFrame), "Check whether df is Pandas Dataframe or not."
+
+    logger = logging.getLogger(__name__)
+    df = df.copy(deep=False)
+
+    for col, dtype in SCHEMA.items():
+        if col not in df.columns or df[col].dtype == dtype or is_list_column(df[col]):
+            continue
+
+        if dtype.startswith("datetime"):
+            parsed = pd.to_datetime(df[col], errors="coerce")
+            n_bad = int((parsed.isna() & df[col].notna()).sum())
+            if n_bad:
+                logger.warning("%d value(s) of %s are not dates", n_bad, col)
+            df[col] = parsed
+        elif dtype == "category":
+            # read_csv may mix ints and strings in one column, e.g. 54 and "41G".
+            # astype(str) can write "nan" into the buffer of an unpickled column,
+            # as sent to a worker process, so it converts a copy.
+            col_values = df[col]
+            if col_values.dtype == object:
+                col_values = col_values.where(
+                    col_values.isna(), col_values.copy().astype(str)
+                )
+            df[col] = col_values.astype(dtype)
+        else:
+            df[col] = df[col].astype(dtype)
+
+    return df
+
+
+def read_processed(path, columns=None):
+    """Reads a processed CAERS csv written by make_dataset with the declared types.
+
+    Args:
+        path (Path): Processed csv file.
+        columns (list, optional): Columns to be read. Defaults to None (all columns).
+
+    Returns:
+        [pd.DataFrame]: Typed data.
+    """
+    usecols = None if columns is None else lambda c: c in columns or c == "Unnamed: 0"
+    df = pd.read_csv(path, index_col=0, usecols=usecols, low_memory=False)
+    df.index.name = None
+    return apply_schema(df)
+
+
+def memory_report(paths):
+    """Compares the in-memory size of processed files read untyped and typed.
+
+    Args:
+        paths (list): Processed csv files.
+
+    Returns:
+        [pd.DataFrame]: rows and bytes per row before and after typing, per file.
+    """
+    report = []
+    for p in paths:
+        untyped = pd.read_csv(p, index_col=0, low_memory=False)
+        typed = apply_schema(untyped)
+        before = untyped.memory_usage(deep=True).sum() / max(len(untyped), 1)
+        after = typed.memory_usage(deep=True).sum() / max(len(typed), 1)
+        report.append(
+            {
+                "file": Path(p).name,
+                "rows": len(untyped),
+                "bytes_per_row_before": round(before, 1),
+                "bytes_per_row_after": round(after, 1),
+                "ratio": round(before / after, 2),
+            }
+        )
+    return pd.DataFrame(report).set_index("file")
+
+
+@click.command()
+@click.argument("processed_dirpath", type=click.Path(exists=True))
+def main(processed_dirpath="../../data/processed"):
+    """ Prints the bytes per row of every processed csv, untyped and typed.
+    """
+    logger = logging.getLogger(__name__)
+    report = memory_report(sorted(Path(processed_dirpath).glob("*_data*.csv")))
+    logger.info("Memory report\n%s", report.to_string())
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    main()
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from multivalue import (
+    MultiValued,
+    encode_multivalued,
+    explode_positions,
+    join_items,
+    select_reports,
+)
+
+# Directory of the star schema inside the processed data directory.
+STAR_DIR = "star"
+
+# Report attributes stored in fact_report as keys of a dim_<column> table.
+DIMENSION_COLUMNS = [
+    "report_id",
+    "product_type",
+    "product",
+    "product_code",
+    "category",
+    "age_units",
+    "sex",
+    "brand",
+]
+
+# Multi-valued columns stored as bridge fact tables, by dimension name.
+BRIDGES = {"symptom": "medra_preferred_terms", "outcome": "outcomes"}
+
+# Date columns stored in fact_report as yyyymmdd keys of dim_date.
+DATE_COLUMNS = {
+    "caers_created_date": "created_date_key",
+    "date_of_event": "event_date_key",
+}
+
+CLEAN_COLUMNS = [
+    "report_id",
+    "caers_created_date",
+    "date_of_event",
+    "product_type",
+    "product",
+    "product_code",
+    "category",
+    "patient_age",
+    "age_units",
+    "sex",
+    "medra_preferred_terms",
+    "outcomes",
+]
+
+PROCESSED_COLUMNS = [c for c in CLEAN_COLUMNS if c != "age_units"] + ["brand"]
+
+
+def date_keys(dates):
+    """Encodes dates as yyyymmdd integers, -1 for missing dates.
+
+    Args:
+        dates (pd.Series): Dates.
+
+    Returns:
+        [np.ndarray]: int32 key of every date.
+    """
+    dates = pd.to_datetime(dates)
+    keys = dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+    return keys.fillna(-1).values.astype(np.int32)
+
+
+def key_dates(keys):
+    """Inverse of date_keys.
+
+    Args:
+        keys (np.ndarray): yyyymmdd keys, -1 for missing dates.
+
+    Returns:
+        [pd.Series]: Dates.
+    """
+    keys = pd.Series(keys).where(pd.Series(keys) >= 0)
+    parts = pd.DataFrame(
+        {"year": keys // 10000, "month": keys // 100 % 100, "day": keys % 100}
+    )
+    return pd.to_datetime(parts)
+
+
+def date_dimension(keys):
+    """Makes the dim_date table of date keys.
+
+    Args:
+        keys (np.ndarray): yyyymmdd keys, -1 for missing dates.
+
+    Returns:
+        [pd.DataFrame]: date_key, date, year, month and day of every distinct date.
+    """
+    keys = np.unique(keys)
+    keys = keys[keys >= 0]
+    dim_date = pd.DataFrame({"date_key": keys, "date": key_dates(keys)})
+    dim_date["year"] = dim_date["date"].dt.year
+    dim_date["month"] = dim_date["date"].dt.month
+    dim_date["day"] = dim_date["date"].dt.day
+    return dim_date
+
+
+def build_star(clean, brands, ages, processed, time_reports):
+    """Splits the clean reports into dimension tables and integer fact tables.
+
+    fact_report has one row per clean report with dimension keys, the reported age,
+    the age in year(s), and flags telling whether the report is in processed_data
+    (its age unit is known) and in clean_data_time (first report of its TIME_KEYS).
+    fact_report_symptom and fact_report_outcome have one row per report item, in
+    item order.
+
+    Args:
+        clean (pd.DataFrame): clean_data reports.
+        brands (pd.Series): brand of every report.
+        ages (pd.Series): patient_age of every report converted to year(s).
+        processed (np.ndarray): Boolean mask of the reports of processed_data.
+        time_reports (np.ndarray): Boolean mask of the reports of clean_data_time.
+
+    Returns:
+        [dict]: table name to DataFrame.
+    """
+    assert isinstance(clean, pd.DataFrame), "Check whether clean is Pandas Dataframe."
+    assert (
+        len(brands) == len(ages) == len(processed) == len(time_reports) == len(clean)
+    ), "Check whether all inputs are aligned with clean."
+
+    clean = clean.reset_index(drop=True).assign(brand=np.asarray(brands, dtype=object))
+    tables = {}
+    fact = pd.DataFrame(index=clean.index)
+
+    for col in DIMENSION_COLUMNS:
+        codes, uniques = pd.factorize(clean[col].astype(object), sort=True)
+        # Streamed chunks may hold numeric codes, e.g. product_code 54 next to "41G".
+        values = np.asarray(uniques, dtype=object).astype(str)
+        tables["dim_%s" % col] = pd.DataFrame(
+            {"%s_key" % col: np.arange(len(uniques)), col: values}
+        )
+        fact["%s_key" % col] = codes.astype(np.int32)
+
+    all_dates = []
+    for col, key_col in DATE_COLUMNS.items():
+        fact[key_col] = date_keys(clean[col])
+        all_dates.append(fact[key_col].values)
+    tables["dim_date"] = date_dimension(np.concatenate(all_dates))
+
+    fact["patient_age"] = clean["patient_age"].values
+    fact["patient_age_years"] = np.asarray(ages, dtype=float)
+    fact["is_processed"] = np.asarray(processed).astype(np.int8)
+    fact["is_time_report"] = np.asarray(time_reports).astype(np.int8)
+    tables["fact_report"] = fact
+
+    for name, col in BRIDGES.items():
+        mv = encode_multivalued(clean[col])
+        tables["dim_%s" % name] = pd.DataFrame(
+            {"%s_key" % name: np.arange(len(mv.dictionary)), name: mv.dictionary}
+        )
+        tables["fact_report_%s" % name] = pd.DataFrame(
+            {
+                "report_row": np.repeat(
+                    np.arange(len(clean), dtype=np.int32), np.diff(mv.offsets)
+                ),
+                "%s_key" % name: mv.codes,
+            }
+        )
+
+    return tables
+
+
+def write_star(tables, root):
+    """Writes the star schema tables as csv files. The tables are written next to
+    root and moved in place, so readers never see a partial schema.
+
+    Args:
+        tables (dict): table name to DataFrame.
+        root (Path): Directory of the star schema.
+    """
+    root = Path(root)
+    tmp = root.with_name(root.name + ".tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+    for name, table in tables.items():
+        table.to_csv(tmp / ("%s.csv" % name), index=False)
+    if root.exists():
+        shutil.rmtree(root)
+    tmp.rename(root)
+
+
+def read_table(path):
+    """Reads one star schema table written by write_star.
+
+    Args:
+        path (Path): csv file of the table.
+
+    Returns:
+        [pd.DataFrame]: The table.
+    """
+    name = Path(path).stem
+    if name.startswith("dim_") and name != "dim_date":
+        # Dimension values are strings, including "" and numeric looking codes.
+        value = name[len("dim_") :]
+        return pd.read_csv(path, dtype={value: str}, keep_default_na=False)
+    return pd.read_csv(path, parse_dates=["date"] if name == "dim_date" else None)
+
+
+def read_star(root):
+    """Reads the star schema tables written by write_star.
+
+    Args:
+        root (Path): Directory of the star schema.
+
+    Returns:
+        [dict]: table name to DataFrame.
+    """
+    return {path.stem: read_table(path) for path in sorted(Path(root).glob("*.csv"))}
+
+
+class StarBuilder:
+    """Writes the star schema chunk by chunk, for outputs that are streamed or
+    appended to. Dimension keys are numbered in order of appearance while chunks
+    are added, and the fact tables are spooled to csv files meanwhile, so memory
+    only holds the dimension values. close numbers the keys in sorted order, which
+    gives the same tables as write_star of build_star over all reports at once.
+
+    Args:
+        root (Path): Directory of the star schema.
+        chunksize (int, optional): Rows of the spooled fact tables read at once by close. Defaults to None (whole tables).
+        resume (bool, optional): Add the chunks to the schema already in root. Defaults to False.
+    """
+
+    def __init__(self, root, chunksize=None, resume=False):
+        self.root = Path(root)
+        self.chunksize = chunksize
+        self.tmp = self.root.with_name(self.root.name + ".tmp")
+        if self.tmp.exists():
+            shutil.rmtree(self.tmp)
+        self.tmp.mkdir(parents=True)
+
+        # Provisional key of every dimension value, by dimension name.
+        self.keys = {name: {} for name in DIMENSION_COLUMNS + list(BRIDGES)}
+        self.dates = np.array([], dtype=np.int32)
+        self.rows = 0
+        if resume:
+            for name, values in self.keys.items():
+                dim = read_table(self.root / ("dim_%s.csv" % name))
+                values.update(zip(dim[name], dim["%s_key" % name]))
+            self.dates = read_table(self.root / "dim_date.csv")["date_key"].values
+            for name in self.fact_tables():
+                shutil.copyfile(
+                    self.root / ("%s.csv" % name), self.tmp / ("%s.part" % name)
+                )
+            with open(self.root / "fact_report.csv") as f:
+                self.rows = sum(1 for _ in f) - 1
+
+    @staticmethod
+    def fact_tables():
+        """Gets the names of the fact tables.
+
+        Returns:
+            [list]: fact_report and the bridge tables.
+        """
+        return ["fact_report"] + ["fact_report_%s" % name for name in BRIDGES]
+
+    def provisional_keys(self, name, values):
+        """Gets the provisional keys of the values of a chunk dimension table.
+
+        Args:
+            name (str): Dimension name.
+            values (pd.Series): Values of the chunk dimension, in key order.
+
+        Returns:
+            [np.ndarray]: provisional key of every chunk key, then -1 for code -1.
+        """
+        keys = self.keys[name]
+        return np.array([keys.setdefault(v, len(keys)) for v in values] + [-1])
+
+    def spool(self, name, table):
+        """Appends a chunk of a fact table to its spool file.
+
+        Args:
+            name (str): Fact table name.
+            table (pd.DataFrame): Rows with provisional keys.
+        """
+        path = self.tmp / ("%s.part" % name)
+        table.to_csv(path, mode="a", header=not path.exists(), index=False)
+
+    def add(self, clean, brands, ages, processed, time_reports):
+        """Adds a chunk of clean reports, with the arguments of build_star.
+
+        Args:
+            clean (pd.DataFrame): clean_data reports.
+            brands (pd.Series): brand of every report.
+            ages (pd.Series): patient_age of every report converted to year(s).
+            processed (np.ndarray): Boolean mask of the reports of processed_data.
+            time_reports (np.ndarray): Boolean mask of the reports of clean_data_time.
+        """
+        tables = build_star(clean, brands, ages, processed, time_reports)
+        fact = tables["fact_report"]
+        for col in DIMENSION_COLUMNS:
+            keys = self.provisional_keys(col, tables["dim_%s" % col][col])
+            fact["%s_key" % col] = keys[fact["%s_key" % col].values]
+        self.dates = np.union1d(self.dates, tables["dim_date"]["date_key"].values)
+        self.spool("fact_report", fact)
+
+        for name in BRIDGES:
+            bridge = tables["fact_report_%s" % name]
+            keys = self.provisional_keys(name, tables["dim_%s" % name][name])
+            bridge["%s_key" % name] = keys[bridge["%s_key" % name].values]
+            bridge["report_row"] += self.rows
+            self.spool("fact_report_%s" % name, bridge)
+        self.rows += len(fact)
+
+    def close(self):
+        """Writes the dimension tables, renumbers the keys of the spooled fact tables
+        in sorted order and moves the schema in place of root.
+        """
+        remaps = {}
+        for name, keys in self.keys.items():
+            values = sorted(keys)
+            # Final key of every provisional key, then -1 for code -1.
+            remap = np.full(len(keys) + 1, -1)
+            remap[[keys[v] for v in values]] = np.arange(len(values))
+            remaps["%s_key" % name] = remap
+            pd.DataFrame(
+                {"%s_key" % name: np.arange(len(values)), name: values}
+            ).to_csv(self.tmp / ("dim_%s.csv" % name), index=False)
+        date_dimension(self.dates).to_csv(self.tmp / "dim_date.csv", index=False)
+
+        for name in self.fact_tables():
+            part = self.tmp / ("%s.part" % name)
+            path = self.tmp / ("%s.csv" % name)
+            if not part.exists():
+                continue
+            reader = pd.read_csv(
+                part, chunksize=self.chunksize, float_precision="round_trip"
+            )
+            if self.chunksize is None:
+                reader = [reader]
+            for i, table in enumerate(reader):
+                for col in table.columns:
+                    if col in remaps:
+                        table[col] = remaps[col][table[col].values]
+                table.to_csv(path, mode="a", header=i == 0, index=False)
+            part.unlink()
+
+        if self.root.exists():
+            shutil.rmtree(self.root)
+        self.tmp.rename(self.root)
+
+
+def item_columns(tables, name):
+    """Gets a bridge table in CSR form over the rows of fact_report.
+
+    Args:
+        tables (dict): Star schema tables.
+        name (str): Bridge name, "symptom" or "outcome".
+
+    Returns:
+        [MultiValued]: items of every report.
+    """
+    bridge = tables["fact_report_%s" % name]
+    lengths = np.bincount(bridge["report_row"], minlength=len(tables["fact_report"]))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    dictionary = list(tables["dim_%s" % name][name])
+    return MultiValued(offsets, bridge["%s_key" % name].values, dictionary)
+
+
+def report_view(tables):
+    """Joins fact_report with its dimensions into clean_data columns plus brand,
+    the age in year(s) and the report flags.
+
+    Args:
+        tables (dict): Star schema tables.
+
+    Returns:
+        [pd.DataFrame]: one row per clean report.
+    """
+    fact = tables["fact_report"]
+    df = pd.DataFrame(index=fact.index)
+    for col in DIMENSION_COLUMNS:
+        categories = tables["dim_%s" % col][col].values
+        df[col] = pd.Categorical.from_codes(fact["%s_key" % col], categories=categories)
+    for col, key_col in DATE_COLUMNS.items():
+        df[col] = key_dates(fact[key_col].values).values
+    df["patient_age"] = fact["patient_age"]
+    df["patient_age_years"] = fact["patient_age_years"]
+    for name, col in BRIDGES.items():
+        df[col] = join_items(item_columns(tables, name))
+    df["is_processed"] = fact["is_processed"].astype(bool)
+    df["is_time_report"] = fact["is_time_report"].astype(bool)
+    return df
+
+
+def legacy_view(tables, name):
+    """Reconstructs one of the legacy csv data sets from the star schema.
+
+    Args:
+        tables (dict): Star schema tables.
+        name (str): "clean_data", "processed_data", "exploded_data", "clean_data_time" or "exploded_data_time".
+
+    Returns:
+        [pd.DataFrame]: the data set, with the types of the schema.
+    """
+    reports = report_view(tables)
+    if name == "clean_data":
+        return reports[CLEAN_COLUMNS]
+
+    processed = reports["is_processed"].values
+    time_reports = reports["is_time_report"].values[processed]
+    reports = reports[processed].reset_index(drop=True)
+    reports["patient_age"] = reports["patient_age_years"]
+    outcomes = select_reports(item_columns(tables, "outcome"), processed)
+    reports = reports[PROCESSED_COLUMNS]
+    if name == "processed_data":
+        return reports
+
+    if name in ["clean_data_time", "exploded_data_time"]:
+        reports = reports[time_reports].reset_index(drop=True)
+        reports = reports.rename(columns={"caers_created_date": "time_stamp"})
+        reports["year"] = reports["time_stamp"].dt.year.astype(np.int16)
+        outcomes = select_reports(outcomes, time_reports)
+
+    if name == "clean_data_time":
+        reports["outcomes"] = [
+            [outcomes.dictionary[c] for c in outcomes.codes[start:end]]
+            for start, end in zip(outcomes.offsets[:-1], outcomes.offsets[1:])
+        ]
+        return reports
+
+    rows, codes = explode_positions(outcomes)
+    dictionary = np.array(outcomes.dictionary, dtype=object)
+    if name == "exploded_data_time":
+        dictionary[dictionary == ""] = "Not Specified"
+    exploded = reports.iloc[rows].reset_index(drop=True)
+    values = np.full(len(codes), None, dtype=object)
+    values[codes >= 0] = dictionary[codes[codes >= 0]]
+    exploded["outcomes"] = pd.Categorical(values)
+    return exploded
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import click
+import csv
+import logging
+import math
+from collections import namedtuple
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Positions of fields of a raw CAERS row. Every row of a report holds the same id,
+# dates, patient, MedDRA terms and outcomes; product type, product, product code
+# and description vary per product.
+PRODUCT_FIELD = 4
+DESCRIPTION_FIELD = 6
+DATE_FIELD = 1
+
+# Raw files are read as make_dataset.read_raw_file reads them, but as raw text.
+# Written back in latin-1, every character below 256 is the byte it was decoded
+# from, e.g. the Windows-1252 0x92 and 0xAE, and other characters become \uXXXX
+# escapes that unicode_escape decodes again.
+RAW_ENCODING = "unicode_escape"
+WRITE_ENCODING = "latin-1"
+
+# Rows per raw file, about the size of the real files.
+ROWS_PER_FILE = 50000
+
+# Real reports and products from which the synthetic ones are drawn. Rows of
+# report i are rows[starts[i]:starts[i] + counts[i]]. Products of the rows of
+# description d are products[order[offsets[d]:offsets[d + 1]]].
+RawSample = namedtuple(
+    "RawSample",
+    [
+        "rows",
+        "starts",
+        "counts",
+        "headers",
+        "descriptions",
+        "order",
+        "offsets",
+        "new_rate",
+    ],
+)
+
+
+def load_raw_sample(paths):
+    """Reads real raw CAERS files as text and indexes their reports and the
+    products of every description (category).
+
+    Args:
+        paths (list): Paths of raw CAERS_ASCII_*.csv files.
+
+    Returns:
+        [RawSample]: Reports and products to draw from.
+    """
+    frames = [
+        pd.read_csv(p, encoding=RAW_ENCODING, dtype=str, keep_default_na=False)
+        for p in paths
+    ]
+    headers = [list(df.columns) for df in frames]
+    rows = np.concatenate([df.values for df in frames])
+
+    # Rows of a report are grouped by report id, in order of first appearance,
+    # since they are not guaranteed to be contiguous in the raw files.
+    reports, _ = pd.factorize(rows[:, 0])
+    order = np.argsort(reports, kind="stable")
+    rows, reports = rows[order], reports[order]
+    starts = np.flatnonzero(np.r_[True, reports[1:] != reports[:-1]])
+    counts = np.diff(np.r_[starts, len(rows)])
+
+    codes, descriptions = pd.factorize(rows[:, DESCRIPTION_FIELD])
+    order = np.argsort(codes, kind="stable")
+    offsets = np.zeros(len(descriptions) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(descriptions)), out=offsets[1:])
+
+    # Good-Turing estimate of the chance that the next product was never seen:
+    # the share of rows whose product appears once.
+    products = pd.Series(rows[:, PRODUCT_FIELD]).value_counts()
+    new_rate = (products == 1).sum() / len(rows)
+
+    return RawSample(
+        rows, starts, counts, headers, np.asarray(codes), order, offsets, new_rate,
+    )
+
+
+def new_products(sample, rows, rng):
+    """Makes product names that were never seen, each from two real products of
+    the same description: the first word of one and the rest of the other, e.g.
+    "KASHI" and "ORGANIC RAISIN BRAN" of "KELLOGG'S ORGANIC RAISIN BRAN".
+
+    Args:
+        sample (RawSample): Real reports and products.
+        rows (np.ndarray): Positions in sample.rows of the rows to be renamed.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        [list]: new product name of every row.
+    """
+    codes = sample.descriptions[rows]
+    sizes = sample.offsets[codes + 1] - sample.offsets[codes]
+    donors = sample.order[
+        sample.offsets[codes] + (rng.random(len(rows)) * sizes).astype(np.int64)
+    ]
+
+    names = []
+    for head, tail in zip(
+        sample.rows[rows, PRODUCT_FIELD], sample.rows[donors, PRODUCT_FIELD]
+    ):
+        head, tail = head.split(" ", 1)[0], tail.split(" ", 1)
+        names.append(head if len(tail) < 2 else "%s %s" % (head, tail[1]))
+    return names
+
+
+def synthesize_rows(sample, n_rows, first_id, rng):
+    """Draws whole real reports, so that categories, products per report, ages,
+    age units, sexes, MedDRA term lists and outcome lists keep their joint
+    distribution, gives them new report ids and renames products at the rate of
+    unseen products of the real data. Rows are sorted by creation date like the
+    real files.
+
+    Args:
+        sample (RawSample): Real reports and products.
+        n_rows (int): About how many rows to draw.
+        first_id (int): Number of the first report id.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        [tuple]: (raw rows as a 2-d object array, number of reports)
+    """
+    n_reports = max(1, int(round(n_rows * len(sample.starts) / len(sample.rows))))
+    reports = rng.integers(0, len(sample.starts), n_reports)
+
+    dates = pd.to_datetime(
+        sample.rows[sample.starts[reports], DATE_FIELD], format="%m/%d/%Y"
+    )
+    order = np.argsort(dates.values, kind="stable")
+    reports = reports[order]
+    years = dates.year.values[order]
+
+    counts = sample.counts[reports]
+    report_of_row = np.repeat(np.arange(n_reports), counts)
+    positions = np.repeat(sample.starts[reports], counts) + (
+        np.arange(len(report_of_row)) - np.repeat(np.cumsum(counts) - counts, counts)
+    )
+    rows = sample.rows[positions].copy()
+
+    ids = np.array(
+        ["%d-CFS-%06d" % (year, first_id + i) for i, year in enumerate(years)],
+        dtype=object,
+    )
+    rows[:, 0] = ids[report_of_row]
+
+    renamed = np.flatnonzero(rng.random(len(rows)) < sample.new_rate)
+    rows[renamed, PRODUCT_FIELD] = new_products(sample, positions[renamed], rng)
+    return rows, n_reports
+
+
+def write_raw_file(rows, header, path):
+    """Writes rows the way the raw CAERS files are written: latin-1 bytes, quoted
+    fields where needed and CRLF line endings.
+
+    Args:
+        rows (np.ndarray): Raw rows as a 2-d object array.
+        header (list): Column names.
+        path (Path): Output csv file.
+    """
+    with open(
+        path, "w", encoding=WRITE_ENCODING, errors="backslashreplace", newline=""
+    ) as f:
+        writer = csv.writer(f, lineterminator="\r\n")
+        writer.writerow(header)
+        writer.writerows(rows.tolist())
+
+
+@click.command()
+@click.argument("input_dirpath", type=click.Path(exists=True))
+@click.argument("output_dirpath", type=click.Path())
+@click.option(
+    "--scale",
+    default=10.0,
+    type=float,
+    help="Number of rows as a multiple of the rows of the real files.",
+)
+@click.option(
+    "--rows-per-file", default=ROWS_PER_FILE, type=int, help="Rows of every file."
+)
+@click.option("--seed", default=0, type=int, help="Seed of the random generator.")
+def main(
+    input_dirpath="../../data/raw/",
+    output_dirpath="../../data/synthetic",
+    scale=10.0,
+    rows_per_file=ROWS_PER_FILE,
+    seed=0,
+):
+    """ Writes synthetic raw CAERS files at a multiple of the size of the real
+        raw files (in ../raw), to be processed by make_dataset.py like them.
+    """
+    logger = logging.getLogger(__name__)
+    outPath = Path(output_dirpath)
+    outPath.mkdir(parents=True, exist_ok=True)
+
+    sample = load_raw_sample(sorted(Path(input_dirpath).glob("*.csv")))
+    logger.info(
+        "Drawing from %d reports (%d rows), %.1f%% new product names",
+        len(sample.starts),
+        len(sample.rows),
+        100 * sample.new_rate,
+    )
+
+    total = int(round(scale * len(sample.rows)))
+    n_files = max(1, math.ceil(total / rows_per_file))
+    rng = np.random.default_rng(seed)
+    first_id = 1
+    for i in range(n_files):
+        n_rows = min(rows_per_file, total - i * rows_per_file)
+        rows, n_reports = synthesize_rows(sample, n_rows, first_id, rng)
+        first_id += n_reports
+
+        # Files cycle through the headers of the real files, which differ in
+        # the spelling of the MedDRA column.
+        path = outPath / ("CAERS_ASCII_synthetic_%05d.csv" % i)
+        write_raw_file(rows, sample.headers[i % len(sample.headers)], path)
+        logger.info("Wrote %d rows to %s", len(rows), path.name)
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    main()
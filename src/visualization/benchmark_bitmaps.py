@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from bitmap_index import BitmapIndex
+
+RELV_OUTCOMES = [
+    "Death",
+    "Life Threatening",
+    "Hospitalization",
+    "Disability",
+    "Patient Visited ER",
+]
+
+
+def time_call(func, repeat=3):
+    """Runs func repeat times and returns the best wall time.
+
+    Args:
+        func (callable): Function without arguments.
+        repeat (int, optional): Number of runs. Defaults to 3.
+
+    Returns:
+        [tuple]: (best wall time in seconds, result of the last run)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def filters(category):
+    """Gets the row filters of brands_vs_outcomes_plot, symptom_counter and
+    age_dist_plot, as boolean masks and as bitmap index selections.
+
+    Args:
+        category (str): Category of the filters.
+
+    Returns:
+        [dict]: filter name to (mask function of a DataFrame, select function of a BitmapIndex)
+    """
+    cases = {
+        "category & product": (
+            lambda df: (df["category"] == category) & (df["product"] != "EXEMPTION 4"),
+            lambda ix: ix.select(exclude={"product": "EXEMPTION 4"}, category=category),
+        ),
+        "category": (
+            lambda df: df["category"] == category,
+            lambda ix: ix.select(category=category),
+        ),
+        "brand": (
+            lambda df: df["brand"] == "QUORN",
+            lambda ix: ix.select(brand="QUORN"),
+        ),
+    }
+    for outcome in RELV_OUTCOMES:
+        cases["category & %s" % outcome] = (
+            lambda df, o=outcome: (df["category"] == category) & (df["outcomes"] == o),
+            lambda ix, o=outcome: ix.select(category=category, outcomes=o),
+        )
+    return cases
+
+
+@click.command()
+@click.argument("exploded_data_path", type=click.Path(exists=True))
+@click.option("--category", default="Cosmetics", help="Category of the filters.")
+@click.option("--repeat", default=5, type=int, help="Runs per implementation.")
+def main(
+    exploded_data_path="../../data/processed/exploded_data.csv",
+    category="Cosmetics",
+    repeat=5,
+):
+    """ Compares the boolean masks of the visualization functions with the same
+        filters answered by a BitmapIndex over exploded_data.csv.
+    """
+    logger = logging.getLogger(__name__)
+
+    df = pd.read_csv(Path(exploded_data_path), index_col=0, low_memory=False)
+    build_time, index = time_call(
+        lambda: BitmapIndex(df, ["category", "outcomes", "sex", "brand", "product"]), 1
+    )
+    logger.info("BitmapIndex over %d rows built in %.2f s", len(df), build_time)
+
+    for name, (mask, select) in filters(category).items():
+        mask_time, rows = time_call(lambda: np.flatnonzero(mask(df).values), repeat)
+        bitmap_time, bitmap_rows = time_call(lambda: index.rows(select(index)), repeat)
+        assert np.array_equal(rows, bitmap_rows), "%s rows differ" % name
+        logger.info(
+            "%-40s %7d rows  mask %7.2f ms  bitmap %7.2f ms  speedup %5.1fx",
+            name,
+            len(rows),
+            mask_time * 1e3,
+            bitmap_time * 1e3,
+            mask_time / bitmap_time,
+        )
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    main()
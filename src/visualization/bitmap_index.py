@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+# Columns with at most this many values get a precomputed bitmap per value.
+# Bitmaps of columns with more values, like brand or product, are packed on
+# demand from the sorted rows of the value.
+MAX_DENSE_VALUES = 256
+
+# Number of set bits of every byte.
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class BitmapIndex:
+    """Packed bitsets of the rows holding every value of some columns, built once per
+    loaded data set. Conjunctive filters are answered with bitwise AND/OR/NOT over
+    the bitsets, one bit per row, instead of comparing full string columns.
+
+    Args:
+        df (pd.DataFrame): Data to be indexed. Filters return positions in df.
+        columns (list): Columns to be indexed, e.g. ["category", "outcomes", "brand"].
+    """
+
+    def __init__(self, df, columns):
+        assert isinstance(df, pd.DataFrame), "Check whether df is Pandas Dataframe."
+
+        self.n_rows = len(df)
+        self.all = np.packbits(np.ones(self.n_rows, dtype=bool))
+        self.codes = {}
+        self.order = {}
+        self.offsets = {}
+        self.bitmaps = {}
+
+        for col in columns:
+            codes, uniques = pd.factorize(df[col].astype(object))
+            self.codes[col] = {v: i for i, v in enumerate(uniques)}
+
+            # Rows of every value, CSR style: order[offsets[i]:offsets[i + 1]].
+            known = codes >= 0
+            order = np.argsort(codes, kind="stable")[np.count_nonzero(~known) :]
+            offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+            np.cumsum(
+                np.bincount(codes[known], minlength=len(uniques)), out=offsets[1:]
+            )
+            self.order[col] = order
+            self.offsets[col] = offsets
+
+            if len(uniques) <= MAX_DENSE_VALUES:
+                bits = np.zeros((len(uniques), self.n_rows), dtype=bool)
+                bits[codes[known], np.flatnonzero(known)] = True
+                self.bitmaps[col] = np.packbits(bits, axis=1)
+
+    def __len__(self):
+        return self.n_rows
+
+    def pack(self, rows):
+        """Packs row positions into a bitset.
+
+        Args:
+            rows (np.ndarray): Row positions.
+
+        Returns:
+            [np.ndarray]: uint8 bitset, one bit per row.
+        """
+        bits = np.zeros(self.n_rows, dtype=bool)
+        bits[rows] = True
+        return np.packbits(bits)
+
+    def bitmap(self, col, values):
+        """Gets the bitset of the rows holding any of values in col.
+
+        Args:
+            col (str): Indexed column.
+            values: Value or list of values.
+
+        Returns:
+            [np.ndarray]: uint8 bitset, one bit per row.
+        """
+        assert col in self.codes, "%s is not an indexed column" % col
+        values = values if isinstance(values, (list, tuple, set)) else [values]
+        codes = [self.codes[col][v] for v in values if v in self.codes[col]]
+
+        if col in self.bitmaps:
+            if not codes:
+                return np.zeros_like(self.all)
+            return np.bitwise_or.reduce(self.bitmaps[col][codes], axis=0)
+
+        order, offsets = self.order[col], self.offsets[col]
+        rows = [order[offsets[c] : offsets[c + 1]] for c in codes]
+        return self.pack(np.concatenate(rows) if rows else [])
+
+    def select(self, exclude=None, **filters):
+        """Gets the bitset of the rows matching every filter and no exclusion.
+
+        Args:
+            exclude (dict, optional): column to values that rows must not hold. Defaults to None.
+            filters: column to a value or a list of values that rows must hold.
+
+        Returns:
+            [np.ndarray]: uint8 bitset, one bit per row.
+        """
+        bits = self.all.copy()
+        for col, values in filters.items():
+            bits &= self.bitmap(col, values)
+        for col, values in (exclude or {}).items():
+            bits &= ~self.bitmap(col, values)
+        return bits
+
+    def rows(self, bits):
+        """Gets the positions of the rows of a bitset, in increasing order.
+
+        Args:
+            bits (np.ndarray): Bitset of this index.
+
+        Returns:
+            [np.ndarray]: row positions.
+        """
+        return np.flatnonzero(np.unpackbits(bits, count=self.n_rows))
+
+    def count(self, bits):
+        """Counts the rows of a bitset.
+
+        Args:
+            bits (np.ndarray): Bitset of this index.
+
+        Returns:
+            [int]: number of set bits.
+        """
+        return int(POPCOUNT[bits].sum(dtype=np.int64))
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex:
+    """Reusable replacement of df.groupby(keys).get_group. The rows are hashed once
+    into a permutation sorted by group plus group offsets, so every get_group is a
+    slice of the permutation instead of a new groupby over the whole frame.
+
+    Args:
+        df (pd.DataFrame): Data to be grouped.
+        keys (str or list): Column or columns to group by, as for df.groupby.
+    """
+
+    def __init__(self, df, keys):
+        assert isinstance(df, pd.DataFrame), "Check whether df is Pandas Dataframe."
+        self.df = df
+        self.keys = keys
+
+        indices = df.groupby(keys, sort=True).indices
+        self.groups = list(indices)
+        self.lookup = {key: i for i, key in enumerate(self.groups)}
+
+        # Rows of group i are order[offsets[i]:offsets[i + 1]], in frame order.
+        self.offsets = np.zeros(len(self.groups) + 1, dtype=np.int64)
+        np.cumsum([len(rows) for rows in indices.values()], out=self.offsets[1:])
+        self.order = (
+            np.concatenate(list(indices.values()))
+            if indices
+            else np.zeros(0, dtype=np.int64)
+        )
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __contains__(self, key):
+        return key in self.lookup
+
+    def rows(self, key):
+        """Gets the positions of the rows of a group.
+
+        Args:
+            key: Group key, a tuple when grouping by several columns.
+
+        Returns:
+            [np.ndarray]: row positions in increasing order.
+        """
+        if key not in self.lookup:
+            raise KeyError(key)
+        i = self.lookup[key]
+        return self.order[self.offsets[i] : self.offsets[i + 1]]
+
+    def get_group(self, key):
+        """Same as df.groupby(keys).get_group(key).
+
+        Args:
+            key: Group key, a tuple when grouping by several columns.
+
+        Returns:
+            [pd.DataFrame]: rows of the group.
+        """
+        return self.df.iloc[self.rows(key)]
@@ -0,0 +1,89 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+TOKEN_PATTERN = re.compile(r"[A-Z0-9]+")
+
+
+def tokenize(text):
+    """Splits a product name into upper case alphanumeric tokens.
+
+    Args:
+        text (str): Product name.
+
+    Returns:
+        [list]: tokens of the name.
+    """
+    return TOKEN_PATTERN.findall(str(text).upper())
+
+
+class ProductIndex:
+    """Inverted index from the tokens of a product (or brand) column to its rows.
+    Every distinct name is tokenized once, tokens point to the names holding them
+    and names to their rows, so a lookup touches only the matching rows instead
+    of scanning every name with str.contains.
+
+    Args:
+        df (pd.DataFrame): Data to be indexed. Lookups return positions in df.
+        column (str, optional): Column of names. Defaults to "product".
+    """
+
+    def __init__(self, df, column="product"):
+        assert isinstance(df, pd.DataFrame), "Check whether df is Pandas Dataframe."
+        self.n_rows = len(df)
+
+        codes, names = pd.factorize(df[column].astype(object))
+        known = codes >= 0
+        # Rows of name i are order[offsets[i]:offsets[i + 1]].
+        self.order = np.argsort(codes, kind="stable")[np.count_nonzero(~known) :]
+        self.offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes[known], minlength=len(names)), out=self.offsets[1:])
+
+        postings = defaultdict(list)
+        for i, name in enumerate(names):
+            for token in set(tokenize(name)):
+                postings[token].append(i)
+        self.vocabulary = sorted(postings)
+        self.postings = [np.array(postings[t], dtype=np.int64) for t in self.vocabulary]
+
+    def __len__(self):
+        return self.n_rows
+
+    def names(self, query):
+        """Gets the names holding every token of query. A query token also matches
+        the tokens it starts, e.g. QUORN matches QUORNCHICKN.
+
+        Args:
+            query (str): Product or brand name, e.g. "QUORN".
+
+        Returns:
+            [np.ndarray]: ids of the matching names.
+        """
+        matches = None
+        for token in tokenize(query):
+            # Tokens are alphanumeric, so token + "\x7f" bounds every extension.
+            start = bisect_left(self.vocabulary, token)
+            end = bisect_left(self.vocabulary, token + "\x7f")
+            ids = (
+                np.unique(np.concatenate(self.postings[start:end]))
+                if end > start
+                else np.zeros(0, dtype=np.int64)
+            )
+            matches = ids if matches is None else np.intersect1d(matches, ids)
+        return np.zeros(0, dtype=np.int64) if matches is None else matches
+
+    def rows(self, query):
+        """Gets the rows whose name holds every token of query.
+
+        Args:
+            query (str): Product or brand name, e.g. "QUORN".
+
+        Returns:
+            [np.ndarray]: row positions in increasing order.
+        """
+        rows = [
+            self.order[self.offsets[i] : self.offsets[i + 1]] for i in self.names(query)
+        ]
+        return np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
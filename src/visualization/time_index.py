@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+# Largest dense prefix-sum table, in cells (key combinations x days). A daily table
+# over every brand would take about 30k x 6k cells, so such keys are stored sparse.
+DENSE_LIMIT = 10_000_000
+
+
+def day_numbers(dates):
+    """Converts dates to days since 1970-01-01, the unit of datetime64[D].
+
+    Args:
+        dates (pd.Series): Dates.
+
+    Returns:
+        [tuple]: (int64 day of every date, mask of the dates that are not missing)
+    """
+    dates = pd.to_datetime(pd.Series(dates)).values
+    known = ~np.isnat(dates)
+    return dates.astype("datetime64[D]").astype(np.int64), known
+
+
+class TimeIndex:
+    """Prefix sums of daily event counts per combination of key values, built once
+    per data set, e.g. over (category, outcomes) of exploded_data_time. The count of
+    a date window is the difference of two prefix sums, so it does not depend on the
+    number of rows or days, and a monthly series costs one subtraction per month.
+
+    Key combinations times days up to DENSE_LIMIT are stored as a dense table with
+    one prefix-sum row per combination. Larger indexes, e.g. over brand, store the
+    sorted event days of every combination with prefix sums over them, and find the
+    window bounds with two binary searches within the combination.
+
+    Args:
+        dates (pd.Series): Date of every event, events without a date are ignored.
+        keys (pd.DataFrame): Key columns of every event, aligned with dates.
+        weights (np.ndarray, optional): Weight of every event. Defaults to None (each event counts 1).
+    """
+
+    def __init__(self, dates, keys, weights=None):
+        assert isinstance(keys, pd.DataFrame), "Check whether keys is Pandas Dataframe."
+        assert len(keys) == len(dates), "Check whether keys are aligned with dates."
+
+        days, known = day_numbers(dates)
+        keys = keys.reset_index(drop=True).astype(object)
+        weights = np.ones(len(keys)) if weights is None else np.asarray(weights, float)
+
+        grouped = keys.groupby(list(keys.columns), dropna=False, sort=True)
+        codes = grouped.ngroup().values[known]
+        self.keys = grouped.size().index.to_frame(index=False)
+        self.lookup = {
+            col: self.keys.groupby(col, dropna=False).indices for col in self.keys
+        }
+        days, weights = days[known], weights[known]
+
+        self.first_day = int(days.min()) if len(days) else 0
+        self.n_days = int(days.max()) - self.first_day + 1 if len(days) else 0
+        days = days - self.first_day
+
+        self.dense = len(self.keys) * (self.n_days + 1) <= DENSE_LIMIT
+        if self.dense:
+            counts = np.bincount(
+                codes * self.n_days + days,
+                weights=weights,
+                minlength=len(self.keys) * self.n_days,
+            ).reshape(len(self.keys), self.n_days)
+            self.prefix = np.zeros((len(self.keys), self.n_days + 1))
+            np.cumsum(counts, axis=1, out=self.prefix[:, 1:])
+        else:
+            order = np.lexsort((days, codes))
+            self.days = days[order]
+            self.offsets = np.zeros(len(self.keys) + 1, dtype=np.int64)
+            np.cumsum(
+                np.bincount(codes, minlength=len(self.keys)), out=self.offsets[1:]
+            )
+            self.prefix = np.zeros(len(order) + 1)
+            np.cumsum(weights[order], out=self.prefix[1:])
+
+    def combinations(self, **filters):
+        """Gets the key combinations matching filters.
+
+        Args:
+            filters: key column to a value or a list of values. Missing values, None
+                or NaN, match the combinations whose key is missing.
+
+        Returns:
+            [np.ndarray]: positions of the matching combinations.
+        """
+        match = np.arange(len(self.keys))
+        for col, value in filters.items():
+            assert col in self.lookup, "%s is not a key of the index" % col
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            empty = np.zeros(0, dtype=np.int64)
+            # NaN keys differ from each other, so a dict lookup would never find them.
+            missing = np.flatnonzero(self.keys[col].isna().values)
+            rows = [
+                missing if pd.isna(v) else self.lookup[col].get(v, empty)
+                for v in values
+            ]
+            match = np.intersect1d(match, np.concatenate(rows))
+        return match
+
+    def positions(self, dates):
+        """Gets the positions of dates on the day axis of the index, clipped to it.
+
+        Args:
+            dates (list): Dates, e.g. ["2016-03-01"].
+
+        Returns:
+            [np.ndarray]: number of index days before every date.
+        """
+        days = pd.DatetimeIndex(dates).values.astype("datetime64[D]").astype(np.int64)
+        return np.clip(days - self.first_day, 0, self.n_days)
+
+    def window(self, start, end):
+        """Gets the day positions bounding a window.
+
+        Args:
+            start: First date of the window.
+            end: Last date of the window, included.
+
+        Returns:
+            [np.ndarray]: positions of start and of the day after end.
+        """
+        return self.positions(
+            [pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(1, "D")]
+        )
+
+    def cumulative(self, combinations, positions):
+        """Gets the prefix sums of key combinations at day positions, summed over the
+        combinations.
+
+        Args:
+            combinations (np.ndarray): Positions of the key combinations.
+            positions (np.ndarray): Day positions.
+
+        Returns:
+            [np.ndarray]: weight of the events before every position.
+        """
+        if self.dense:
+            return self.prefix[np.ix_(combinations, positions)].sum(axis=0)
+        total = np.zeros(len(positions))
+        for combination in combinations:
+            start, end = self.offsets[combination], self.offsets[combination + 1]
+            found = np.searchsorted(self.days[start:end], positions)
+            total += self.prefix[start + found] - self.prefix[start]
+        return total
+
+    def count(self, start, end, **filters):
+        """Counts the events between two dates, both included.
+
+        Args:
+            start: First date of the window, e.g. "2016-03-01".
+            end: Last date of the window, e.g. "2018-06-30".
+            filters: key column to a value or a list of values, e.g. category="Cosmetics".
+
+        Returns:
+            [float]: weight of the matching events of the window.
+        """
+        before, until = self.cumulative(
+            self.combinations(**filters), self.window(start, end)
+        )
+        return until - before
+
+    def series(self, freq="M", start=None, end=None, **filters):
+        """Counts the events of every period between two dates.
+
+        Args:
+            freq (str, optional): Period frequency, e.g. "D", "W" or "M". Defaults to "M".
+            start (optional): First date. Defaults to None (first day of the index).
+            end (optional): Last date. Defaults to None (last day of the index).
+            filters: key column to a value or a list of values, e.g. outcomes="Death".
+
+        Returns:
+            [pd.Series]: weight of the matching events per period, indexed by period start.
+        """
+        first = np.datetime64(self.first_day, "D")
+        start = first if start is None else start
+        end = first + max(self.n_days - 1, 0) if end is None else end
+        periods = pd.period_range(pd.Timestamp(start), pd.Timestamp(end), freq=freq)
+
+        # Periods are cut at the window, so the first and last may be partial.
+        first, last = self.window(start, end)
+        bounds = np.r_[first, self.positions(periods[1:].start_time), last]
+        counts = np.diff(self.cumulative(self.combinations(**filters), bounds))
+        return pd.Series(counts, index=periods.start_time)
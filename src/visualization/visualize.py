@@ -6,6 +6,79 @@ import plotly.figure_factory as ff
 import pandas as pd
 import numpy as np
 
+from bitmap_index import BitmapIndex
+from group_index import GroupIndex
+from product_index import ProductIndex
+from time_index import TimeIndex
+
+# Measures of the count cubes written by src/data/make_dataset.py (cube_data.csv
+# and cube_data_time.csv): events counts exploded outcome rows, reports counts
+# reports in the cell of their first outcome. Functions taking report-grain rows,
+# e.g. clean_data_time, sum reports by default and those taking exploded rows
+# sum events.
+CUBE_MEASURES = ["events", "reports"]
+
+
+def is_cube(df):
+    """Checks whether df is a count cube rather than raw rows.
+
+    Args:
+        df (pd.DataFrame): input dataframe
+
+    Returns:
+        [bool]: True when df has the cube measures.
+    """
+    return isinstance(df, pd.DataFrame) and all(m in df.columns for m in CUBE_MEASURES)
+
+
+def is_time_index(df):
+    """Checks whether df is a prefix-sum TimeIndex rather than raw rows.
+
+    Args:
+        df: input data
+
+    Returns:
+        [bool]: True when df answers date-range series.
+    """
+    return isinstance(df, TimeIndex)
+
+
+def monthly_counts(df, measure="events", filters=None):
+    """Counts rows of df per month, sums a measure per month when df is a cube, or
+    reads the monthly series of a time index.
+
+    Args:
+        df (pd.DataFrame): raw rows with a time_stamp column, a count cube or a time index
+        measure (str, optional): cube measure to be summed. Defaults to "events".
+        filters (dict, optional): key values of the time index series. Defaults to None.
+
+    Returns:
+        [pd.DataFrame]: date (first day of the month) and counts, sorted by date
+    """
+    if is_time_index(df):
+        counts = df.series("M", **(filters or {}))
+        counts = counts[counts > 0]
+        return pd.DataFrame({"date": counts.index, "counts": counts.values})
+
+    if is_cube(df):
+        # Months since 1970-01, the unit of datetime64[M].
+        months = (df["year"].values - 1970) * 12 + df["month"].values - 1
+        months, inverse = np.unique(months, return_inverse=True)
+        counts = np.bincount(inverse, weights=df[measure].values, minlength=len(months))
+        return pd.DataFrame(
+            {
+                "date": months.astype("datetime64[M]").astype("datetime64[ns]"),
+                "counts": counts.astype(np.int64),
+            }
+        )[counts > 0]
+
+    year_month = pd.DataFrame(
+        df["time_stamp"].groupby(df.time_stamp.dt.to_period("M")).agg("count").items(),
+        columns=["date", "counts"],
+    ).sort_values(by=["date"])
+    year_month["date"] = year_month["date"].apply(lambda x: x.to_timestamp())
+    return year_month
+
 
 def brands_vs_outcomes_plot(
     baseDf,
@@ -18,14 +91,18 @@ def brands_vs_outcomes_plot(
         "Disability",
         "Patient Visited ER",
     ],
+    measure="events",
+    index=None,
 ):
     """ This function plots histogram for the brand names for each category colored with respect to all outcomes.
 
     Args:
-        base_df (pd.DataFrame): Base dataframe with all data.
+        base_df (pd.DataFrame): Base dataframe with all data, or the count cube of the exploded data.
         category (str): Category for which brands have to be plotted.
         title (str): Title of plot
         relv_outcomes (list, optional): Relevant serious outcomes which are considered. Defaults to [ "Death", "Life Threatening", "Hospitalization", "Disability", "Patient Visited ER", ].
+        measure (str, optional): cube measure counted when base_df is a cube. Defaults to "events".
+        index (BitmapIndex, optional): bitmap index of base_df over category and product. Defaults to None.
     """
 
     assert isinstance(
@@ -38,9 +115,20 @@ def brands_vs_outcomes_plot(
     ), "Check whether relv_outcomes is list or not."
     assert len(relv_outcomes) > 1, "Atleast 1 relevant outcome must be selected"
 
-    df = baseDf[
-        (baseDf["category"] == category) & (baseDf["product"] != "EXEMPTION 4")
-    ].copy()
+    if is_cube(baseDf):
+        brands_vs_outcomes_cube(baseDf, category, title, relv_outcomes, measure)
+        return
+
+    if index is not None:
+        assert isinstance(index, BitmapIndex) and len(index) == len(
+            baseDf
+        ), "Check whether index is a BitmapIndex built over baseDf."
+        bits = index.select(exclude={"product": "EXEMPTION 4"}, category=category)
+        df = baseDf.iloc[index.rows(bits)].copy()
+    else:
+        df = baseDf[
+            (baseDf["category"] == category) & (baseDf["product"] != "EXEMPTION 4")
+        ].copy()
 
     df.dropna(inplace=True)
 
@@ -72,8 +160,57 @@ def brands_vs_outcomes_plot(
     fig_pie.show()
 
 
+def brands_vs_outcomes_cube(cube, category, title, relv_outcomes, measure="events"):
+    """Same plots as brands_vs_outcomes_plot over the exploded data, summed from
+    its count cube. Only cells of complete rows are kept, like the dropna of
+    the raw rows. Redacted products are stored in the cube under the brand
+    "EXEMPTION 4".
+
+    Args:
+        cube (pd.DataFrame): Count cube of the exploded data (cube_data.csv).
+        category (str): Category for which brands have to be plotted.
+        title (str): Title of plot
+        relv_outcomes (list): Relevant serious outcomes which are considered.
+        measure (str, optional): cube measure to be summed. Defaults to "events".
+    """
+    df = cube[
+        (cube["category"] == category)
+        & (cube["brand"] != "EXEMPTION 4")
+        & cube["complete"]
+    ]
+
+    topBrandsGroup = (
+        df.groupby(["brand"], observed=True)[measure].sum().sort_values(ascending=False)
+    )
+
+    relv_brands = list(topBrandsGroup.reset_index()["brand"].values[:10])
+    relv_df = df[df["outcomes"].isin(relv_outcomes)]
+    relv_df = relv_df[relv_df["brand"].isin(relv_brands)]
+
+    relv_df = relv_df.groupby(["brand", "outcomes"], observed=True)[measure].sum()
+    relv_df = relv_df.reset_index().rename(columns={"outcomes": "Outcomes"})
+
+    plot_bar_histogram(relv_df, title=title, x="brand", color="Outcomes", y=measure)
+
+    df = df[df["outcomes"].isin(relv_outcomes)]
+    g_top = df.groupby(["brand"], observed=True)[measure].sum()
+    g_top = g_top.sort_values(ascending=False)
+    top_brands_df = g_top.reset_index()[:10].rename(columns={measure: "#events"})
+
+    fig_pie = px.pie(
+        top_brands_df,
+        values="#events",
+        names="brand",
+        title=title,
+        height=800,
+        width=1200,
+    )
+    fig_pie.update_traces(textposition="inside", textinfo="percent+label")
+    fig_pie.show()
+
+
 def plot_bar_histogram(
-    df, title, x="brand", color="Outcomes", barmode="stack", logscale=False
+    df, title, x="brand", color="Outcomes", barmode="stack", logscale=False, y=None
 ):
     """This function plots bar histogram for columnn in dataframe with color as another column.
 
@@ -84,6 +221,7 @@ def plot_bar_histogram(
         color (str, optional): column name for color. Defaults to "Outcomes".
         barmode (str, optional): bar mode-stack or group . Defaults to "stack".
         logscale (bool, optional): whether y-axis (count) has to be log-scaled or not. Defaults to False.
+        y (str, optional): column summed per bar, e.g. a cube measure. Defaults to None (rows are counted).
     """
 
     assert isinstance(df, pd.DataFrame), "Check whether df is Pandas Dataframe or not."
@@ -95,6 +233,7 @@ def plot_bar_histogram(
     fig = px.histogram(
         df,
         x=x,
+        y=y,
         color=color,
         barmode=barmode,
         title=title,
@@ -117,51 +256,51 @@ def plot_bar_histogram(
     fig.show()
 
 
-def plot_time_trend(df, title, x_col="date", y_col="counts"):
+def plot_time_trend(df, title, x_col="date", y_col="counts", measure="reports"):
     """This function returns a plot for time series of input df
 
     Args:
-        df(pd.DataFrame): input dataframe
+        df(pd.DataFrame): input dataframe, a count cube or a time index
         title(str): title of the graph
         x_col(str): x-axis column name
         y_col(str): y-axis column name
+        measure(str): cube measure counted when df is a cube, "events" in place of exploded rows. Defaults to "reports".
 
     Returns: the plotly figure for time series plot
 
     """
-    assert isinstance(df, pd.DataFrame), "Check whether df is Pandas Dataframe or not."
+    assert isinstance(df, pd.DataFrame) or is_time_index(
+        df
+    ), "Check whether df is Pandas Dataframe or a time index."
     assert isinstance(title, str), "Check whether title is string"
     assert isinstance(x_col, str), "Check whether x_col is string"
     assert isinstance(y_col, str), "Check whether y_col is string"
-    year_month = pd.DataFrame(
-        df["time_stamp"].groupby(df.time_stamp.dt.to_period("M")).agg("count").items(),
-        columns=["date", "counts"],
-    ).sort_values(by=["date"])
-    year_month["date"] = year_month["date"].apply(lambda x: x.to_timestamp())
+    year_month = monthly_counts(df, measure)
     fig = px.line(year_month, x=x_col, y=y_col, title=title)
     fig.show()
 
 
 def plot_pie_subplots_yearly(
-    group, title, column_name, dropping=False, d_threshold=1 / 50
+    group, title, column_name, dropping=False, d_threshold=1 / 50, measure="reports"
 ):
     """ This function returns subplots of yearly piechart for the input column name
 
     Args:
-        group(pd.core.groupby.generic.DataFrameGroupBy): input pandas groupby object
+        group(pd.core.groupby.generic.DataFrameGroupBy): input pandas groupby object, or a count cube
         title(str): title of the plot
         column_name(str): the column name of the data of interests
         col_num(int): number of columns
         row_num(int): number of rows
         dropping(bool): if the data needs to group data with respect to d_threshold to "Others"
         d_threshold(float): dropping threshold
+        measure(str): cube measure counted when group is a cube, "events" in place of exploded rows. Defaults to "reports".
 
     Returns: a subplot of pie charts
 
     """
-    assert isinstance(
-        group, pd.core.groupby.generic.DataFrameGroupBy
-    ), "Check whether group is Pandas groupby object"
+    assert isinstance(group, pd.core.groupby.generic.DataFrameGroupBy) or is_cube(
+        group
+    ), "Check whether group is Pandas groupby object or a count cube"
     assert isinstance(title, str), "Check whether title is str."
     assert isinstance(column_name, str), "Check whether column_name is str or not."
     assert isinstance(dropping, bool), "Check whether dropping is bool."
@@ -181,9 +320,17 @@ def plot_pie_subplots_yearly(
     row = 1
     col = 1
     for i in range(2004, 2021):
+        if is_cube(group):
+            counts = (
+                group[group["year"] == i]
+                .groupby(column_name, observed=True)[measure]
+                .sum()
+            )
+            counts = counts[counts > 0]
+        else:
+            counts = group.get_group(i)[column_name].value_counts()
         year_category = pd.DataFrame(
-            group.get_group(i)[column_name].value_counts().items(),
-            columns=[column_name, "counts"],
+            counts.items(), columns=[column_name, "counts"],
         ).sort_values(by=["counts"])
         total = year_category["counts"].sum()
         if dropping:
@@ -210,24 +357,35 @@ def plot_pie_subplots_yearly(
 
 
 def plot_scatters(
-    group, group_names, title, fil=False, filter_list=None, plot_now=False
+    group,
+    group_names,
+    title,
+    fil=False,
+    filter_list=None,
+    plot_now=False,
+    column="outcomes",
+    measure="events",
 ):
     """This function will return a scatter plot of the input group names, with respect to time
 
     Args:
-        group(pd.core.groupby.generic.DataFrameGroupBy): input pandas groupby object
+        group(pd.core.groupby.generic.DataFrameGroupBy): input pandas groupby object, a count cube or a time index
         group_names(list): the name of groups of interest
         fil(bool): if some groups needs to be dropped
         filter_list(list): the list of groups that needs to be dropped
         title(str): title of the graph
         plot_now(bool): if the plot needs to be plotted right now, if false, return the plotly object
+        column(str): cube column or time index key holding the group names
+        measure(str): cube measure counted when group is a cube
 
     Returns: a time series plot
 
     """
-    assert isinstance(
-        group, pd.core.groupby.generic.DataFrameGroupBy
-    ), "Check whether group is Pandas groupby object or not."
+    assert (
+        isinstance(group, pd.core.groupby.generic.DataFrameGroupBy)
+        or is_cube(group)
+        or is_time_index(group)
+    ), "Check whether group is Pandas groupby object, a count cube or a time index."
     assert isinstance(group_names, list) and all(
         isinstance(x, str) for x in group_names
     ), "Check whether group_names is a list of strings only."
@@ -241,15 +399,14 @@ def plot_scatters(
     for i in range(len(group_names)):
         if fil and group_names[i] in filter_list:
             continue
-        outcome = group.get_group(group_names[i])
-        outcome_df = pd.DataFrame(
-            outcome["time_stamp"]
-            .groupby(outcome.time_stamp.dt.to_period("M"))
-            .agg("count")
-            .items(),
-            columns=["date", "counts"],
-        ).sort_values(by=["date"])
-        outcome_df["date"] = outcome_df["date"].apply(lambda x: x.to_timestamp())
+        if is_time_index(group):
+            outcome_df = monthly_counts(group, filters={column: group_names[i]})
+        else:
+            if is_cube(group):
+                outcome = group[group[column] == group_names[i]]
+            else:
+                outcome = group.get_group(group_names[i])
+            outcome_df = monthly_counts(outcome, measure)
         fig.add_trace(
             go.Scatter(
                 x=outcome_df["date"],
@@ -272,11 +429,12 @@ def plot_scatters(
         return fig
 
 
-def get_quorn_pie(exploded_df):
+def get_quorn_pie(exploded_df, measure="events"):
     """ This function will return a pie chart of product pie chart for Quorn
 
     Args:
-        exploded_df(pd.DataFrame): the exploded_dataframe
+        exploded_df(pd.DataFrame): the exploded_dataframe, or its count cube (matched on brand)
+        measure(str): cube measure counted when exploded_df is a cube
 
     Returns: the pie chart for quorn
 
@@ -284,14 +442,23 @@ def get_quorn_pie(exploded_df):
     assert isinstance(
         exploded_df, pd.DataFrame
     ), "Check whether exploded_df is a pd DataFrame."
-    exploded_df = exploded_df.rename(columns={"product": "products"})
-    quorn = exploded_df[exploded_df.products.str.contains("QUORN") == True]
+    if is_cube(exploded_df):
+        quorn = exploded_df[exploded_df.brand.str.contains("QUORN") == True]
+        outcome_counts = quorn.groupby("outcomes", observed=True)[measure].sum()
+        outcome_counts = outcome_counts.sort_values(ascending=False)
+        count = list(outcome_counts)
+        outcomes = list(outcome_counts.index)
+    else:
+        exploded_df = exploded_df.rename(columns={"product": "products"})
+        quorn = exploded_df[exploded_df.products.str.contains("QUORN") == True]
+        outcome_quorn = quorn.groupby("outcomes")
+        count = list(
+            outcome_quorn["outcomes"].agg("count").sort_values(ascending=False)
+        )
+        outcomes = list(
+            outcome_quorn["outcomes"].agg("count").sort_values(ascending=False).index
+        )
     fig = go.Figure()
-    outcome_quorn = quorn.groupby("outcomes")
-    count = list(outcome_quorn["outcomes"].agg("count").sort_values(ascending=False))
-    outcomes = list(
-        outcome_quorn["outcomes"].agg("count").sort_values(ascending=False).index
-    )
     fig.add_trace(
         go.Pie(
             values=count, labels=outcomes, textinfo="none", title="outcome from QUORN"
@@ -300,11 +467,12 @@ def get_quorn_pie(exploded_df):
     fig.show()
 
 
-def get_quorn_bar(exploded_df):
+def get_quorn_bar(exploded_df, measure="events"):
     """This function will return a bar graph for Quorn analysis
 
     Args:
-        exploded_df(pd.DataFrame): the exploded_dataframe
+        exploded_df(pd.DataFrame): the exploded_dataframe, or its count cube (matched on brand)
+        measure(str): cube measure counted when exploded_df is a cube
 
     Returns:the bar chart of quorn outcomes
 
@@ -312,45 +480,117 @@ def get_quorn_bar(exploded_df):
     assert isinstance(
         exploded_df, pd.DataFrame
     ), "Check whether exploded_df is a pd DataFrame."
-    quorn = exploded_df[exploded_df.products.str.contains("QUORN") == True]
-    k = quorn[["outcomes", "year"]]
+    if is_cube(exploded_df):
+        quorn = exploded_df[exploded_df.brand.str.contains("QUORN") == True]
+        k = quorn.groupby(["year", "outcomes"], observed=True)[measure].sum()
+        k = k.reset_index()
+        y = measure
+    else:
+        quorn = exploded_df[exploded_df.products.str.contains("QUORN") == True]
+        k = quorn[["outcomes", "year"]]
+        y = None
     fig = px.histogram(
-        k, x="year", color="outcomes", title="Outcome histogram for Quorn"
+        k, x="year", y=y, color="outcomes", title="Outcome histogram for Quorn"
     )
     fig.show()
 
 
-def plot_normalized_scatters(groups, group_names):
+def product_outcome_pie(exploded_df, name, index=None):
+    """ This function will return a pie chart of the outcomes of any product or brand
+
+    Args:
+        exploded_df(pd.DataFrame): the exploded_dataframe
+        name(str): product or brand name, e.g. "QUORN"
+        index(ProductIndex): product index of exploded_df, built when not given
+
+    Returns: the pie chart of the outcomes of name
+
+    """
+    assert isinstance(
+        exploded_df, pd.DataFrame
+    ), "Check whether exploded_df is a pd DataFrame."
+    assert isinstance(name, str), "Check whether name is a string."
+    if index is None:
+        index = ProductIndex(exploded_df)
+    assert len(index) == len(
+        exploded_df
+    ), "Check whether index is built over exploded_df."
+
+    outcomes = exploded_df[["outcomes"]].iloc[index.rows(name)]
+    outcome_counts = (
+        outcomes.groupby("outcomes")["outcomes"]
+        .agg("count")
+        .sort_values(ascending=False)
+    )
+    fig = go.Figure()
+    fig.add_trace(
+        go.Pie(
+            values=list(outcome_counts),
+            labels=list(outcome_counts.index),
+            textinfo="none",
+            title="outcome from %s" % name,
+        )
+    )
+    fig.show()
+
+
+def product_outcome_bar(exploded_df, name, index=None):
+    """This function will return a bar graph of the yearly outcomes of any product or brand
+
+    Args:
+        exploded_df(pd.DataFrame): the exploded_dataframe with a year column
+        name(str): product or brand name, e.g. "QUORN"
+        index(ProductIndex): product index of exploded_df, built when not given
+
+    Returns:the bar chart of the outcomes of name
+
+    """
+    assert isinstance(
+        exploded_df, pd.DataFrame
+    ), "Check whether exploded_df is a pd DataFrame."
+    assert isinstance(name, str), "Check whether name is a string."
+    if index is None:
+        index = ProductIndex(exploded_df)
+    assert len(index) == len(
+        exploded_df
+    ), "Check whether index is built over exploded_df."
+
+    k = exploded_df[["outcomes", "year"]].iloc[index.rows(name)]
+    fig = px.histogram(
+        k, x="year", color="outcomes", title="Outcome histogram for %s" % name
+    )
+    fig.show()
+
+
+def plot_normalized_scatters(groups, group_names, measure="events", column=None):
     """ This function will return a normalized scatter plot over input groups
 
     Args:
         df(pd.DataFrame): input dataframe
-        groups(list): groups that want to plot and normalized
+        groups(list): groups that want to plot and normalized, raw rows or count cubes, or one time index
+        measure(str): cube measure counted for the groups that are cubes
+        column(str): time index key holding the group names when groups is a time index
 
     Returns:a normalized scatter over time over groups
 
     """
-    assert isinstance(groups, list), "Check whether groups is a list."
-    assert all(
-        isinstance(x, pd.DataFrame) for x in groups
-    ), "Check whether every element in groups is a pd DataFrame."
+    if is_time_index(groups):
+        assert column is not None, "Check whether column is given with a time index."
+    else:
+        assert isinstance(groups, list), "Check whether groups is a list."
+        assert all(
+            isinstance(x, pd.DataFrame) for x in groups
+        ), "Check whether every element in groups is a pd DataFrame."
     assert isinstance(group_names, list) and all(
         isinstance(x, str) for x in group_names
     ), "Check whether group_names is list of string."
     fig = go.Figure()
     for i in range(len(group_names)):
-        cat = groups[i]
-        max_num = max(
-            cat["time_stamp"].groupby(cat.time_stamp.dt.to_period("M")).agg("count")
-        )
-        category_df = pd.DataFrame(
-            (
-                cat["time_stamp"].groupby(cat.time_stamp.dt.to_period("M")).agg("count")
-                / max_num
-            ).items(),
-            columns=["date", "counts"],
-        ).sort_values(by=["date"])
-        category_df["date"] = category_df["date"].apply(lambda x: x.to_timestamp())
+        if is_time_index(groups):
+            category_df = monthly_counts(groups, filters={column: group_names[i]})
+        else:
+            category_df = monthly_counts(groups[i], measure)
+        category_df["counts"] = category_df["counts"] / category_df["counts"].max()
         fig.add_trace(
             go.Scatter(
                 x=category_df["date"],
@@ -367,7 +607,7 @@ def plot_normalized_scatters(groups, group_names):
     )
 
 
-def symptom_counter(data: pd.DataFrame, variable: int = 0):
+def symptom_counter(data: pd.DataFrame, variable: int = 0, index=None):
     """This function will return a dictionary containing counts of each symptom present in data under a given condition, 
     dictated by variable
 
@@ -376,6 +616,7 @@ def symptom_counter(data: pd.DataFrame, variable: int = 0):
         cosmetic (int): 0 -> all categories, all products
                         1 -> only for cosmetics as a categorie
                         2 -> only for quorn as a product
+        index (BitmapIndex): bitmap index of data over category and brand, optional
 
     Returns:
         (dictionary): A dictionary with keys as symptoms and values as total count
@@ -388,7 +629,16 @@ def symptom_counter(data: pd.DataFrame, variable: int = 0):
         isinstance(variable, int) and 0 <= variable <= 2
     ), "variable is not an integer in the range [0,2]"
     dic = defaultdict(int)
-    if variable == 1:
+    if index is not None and variable > 0:
+        assert isinstance(index, BitmapIndex) and len(index) == len(
+            data
+        ), "index is not a BitmapIndex built over data"
+        if variable == 1:
+            bits = index.select(category="Cosmetics")
+        else:
+            bits = index.select(brand="QUORN")
+        data = data.iloc[index.rows(bits)]
+    elif variable == 1:
         data = data.drop(data.index[(data["category"] != "Cosmetics")])
     elif variable == 2:
         data = data.drop(data.index[(data["brand"] != "QUORN")])
@@ -409,6 +659,49 @@ def symptom_counter(data: pd.DataFrame, variable: int = 0):
     return dic
 
 
+def symptom_counter_csr(store, variable: int = 0):
+    """Same as symptom_counter, over the CSR encoded symptoms of a report-grain
+    column store (see src/data/mmap_store.py). Symptoms are counted with a single
+    bincount instead of splitting the symptom strings of every report.
+
+    Args:
+        store (ColumnStore): Column store of processed_data.
+        variable (int): 0 -> all categories, all products
+                        1 -> only for cosmetics as a categorie
+                        2 -> only for quorn as a product
+
+    Returns:
+        (dictionary): A dictionary with keys as symptoms and values as total count
+    """
+    assert len(store) > 0, "store is empty"
+    assert (
+        isinstance(variable, int) and 0 <= variable <= 2
+    ), "variable is not an integer in the range [0,2]"
+    rows = None
+    if variable == 1:
+        rows = store.array("category") == store.code("category", "Cosmetics")
+    elif variable == 2:
+        rows = store.array("brand") == store.code("brand", "QUORN")
+
+    mv = store.multivalued("medra_preferred_terms")
+    codes = mv.codes
+    if rows is not None:
+        codes = codes[np.repeat(rows, np.diff(mv.offsets))]
+    counts = np.bincount(codes, minlength=len(mv.dictionary))
+
+    dic = defaultdict(int)
+    for i in np.flatnonzero(counts):
+        dic[mv.dictionary[i]] = int(counts[i])
+    if variable == 1:
+        del dic[
+            "DEATH"
+        ]  # Since this is probably an error made by doctors, it should be an outcome not a symptom
+        del dic[
+            "INJURY"
+        ]  # Since this is probably an error made by doctors, it should be an outcome not a symptom
+    return dic
+
+
 def top_symptoms(dic, title):
     """Find and plot top symptoms in the dictionary based on count
 
@@ -460,20 +753,19 @@ def top_vitamins_symptom_distribution(data):
     data["category"] = data["category"].str.strip()
     grouped_desc = data.groupby("category")
     add_on_list = []
+    # The exploded symptoms of the vitamins are grouped once for all symptoms.
+    grouped_desc_vit = grouped_desc.get_group("Vit/Min/Prot/Unconv Diet(Human/Animal)")
+    grouped_desc_vit["medra_preferred_terms"] = grouped_desc_vit[
+        "medra_preferred_terms"
+    ].str.split(",")
+    grouped_desc_vit = grouped_desc_vit.explode(
+        "medra_preferred_terms"
+    ).drop_duplicates()
+    grouped_desc_vit["medra_preferred_terms"] = grouped_desc_vit[
+        "medra_preferred_terms"
+    ].str.strip()
+    grouped_desc_vit2 = GroupIndex(grouped_desc_vit, "medra_preferred_terms")
     for symp in symptom_list:
-        grouped_desc_vit = grouped_desc.get_group(
-            "Vit/Min/Prot/Unconv Diet(Human/Animal)"
-        )
-        grouped_desc_vit["medra_preferred_terms"] = grouped_desc_vit[
-            "medra_preferred_terms"
-        ].str.split(",")
-        grouped_desc_vit = grouped_desc_vit.explode(
-            "medra_preferred_terms"
-        ).drop_duplicates()
-        grouped_desc_vit["medra_preferred_terms"] = grouped_desc_vit[
-            "medra_preferred_terms"
-        ].str.strip()
-        grouped_desc_vit2 = grouped_desc_vit.groupby("medra_preferred_terms")
         grouped_desc_vit = grouped_desc_vit2.get_group(symp)
         list_of_counts = grouped_desc_vit["brand"].value_counts()
         list_of_counts = list_of_counts.reset_index()
@@ -510,6 +802,8 @@ def age_dist_plot(
         "Disability",
         "Patient Visited ER",
     ],
+    index=None,
+    groups=None,
 ):
     """Plots a KDE plot for age distribution of reports across top outcomes for a given category
 
@@ -517,6 +811,8 @@ def age_dist_plot(
         baseDf ([type]): [description]
         category (string): Which category of products to plot age distribution for
         relv_outcomes (list, optional):Defaults to [ "Death", "Life Threatening", "Hospitalization", "Disability", "Patient Visited ER", ].
+        index (BitmapIndex, optional): bitmap index of baseDf over category and outcomes. Defaults to None.
+        groups (GroupIndex, optional): group index of baseDf by ["category", "outcomes"], reused across calls. Defaults to None (built once per call).
     """
     assert isinstance(
         baseDf, pd.DataFrame
@@ -528,14 +824,18 @@ def age_dist_plot(
     assert len(relv_outcomes) > 1, "Atleast 1 relevant outcome must be selected"
 
     outcome_age_dist = []
+    if index is None and groups is None:
+        groups = GroupIndex(baseDf, ["category", "outcomes"])
 
     for outcome in relv_outcomes:
-        out_grp = (
-            baseDf.groupby("category")
-            .get_group(category)
-            .groupby("outcomes")
-            .get_group(outcome)
-        )
+        if index is not None:
+            assert isinstance(index, BitmapIndex) and len(index) == len(
+                baseDf
+            ), "Check whether index is a BitmapIndex built over baseDf."
+            bits = index.select(category=category, outcomes=outcome)
+            outcome_age_dist.append(baseDf["patient_age"].iloc[index.rows(bits)])
+            continue
+        out_grp = groups.get_group((category, outcome))
         outcome_age_dist.append(out_grp["patient_age"])
 
     fig1 = ff.create_distplot(
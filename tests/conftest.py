@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+import sys
+from pathlib import Path
+
+# The scripts of src/data and src/visualization import their sibling modules by name.
+for package in ["data", "visualization"]:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / package))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import http.client
+import threading
+import pandas as pd
+import pytest
+
+from cube import REDACTED_PRODUCT
+from risk_service import RiskService, make_server
+
+
+def make_service():
+    """Makes a RiskService over a few reports, most of them redacted."""
+    reports = pd.DataFrame(
+        {
+            "product": [REDACTED_PRODUCT] * 3 + ["QUORN NUGGETS", "QUORN PATTIES"],
+            "brand": ["EXEMPTION"] * 3 + ["QUORN", "QUORN"],
+            "outcomes": ["Death", "Hospitalization", "Other Outcome"]
+            + ["Hospitalization", "Visited Emergency Room"],
+            "medra_preferred_terms": ["NAUSEA"] * 5,
+        }
+    )
+    return RiskService(reports)
+
+
+def test_redacted_names_are_absent():
+    service = make_service()
+    names = [m["name"] for m in service.autocomplete("")]
+    assert REDACTED_PRODUCT not in names
+    assert "EXEMPTION" not in names
+    assert service.autocomplete("EXEMPTION") == []
+    assert service.stats_response(REDACTED_PRODUCT) is None
+    assert service.stats_response("EXEMPTION", "brand") is None
+
+
+def test_redacted_batch_items_are_not_known():
+    results = make_service().batch([REDACTED_PRODUCT, "exemption  4", "QUORN NUGGETS"])
+    assert [r["known"] for r in results] == [False, False, True]
+    assert results[0]["reports"] == 0
+    assert results[0]["serious_outcomes"] == {}
+
+
+@pytest.mark.parametrize("length", [None, "-5", "abc"])
+def test_batch_rejects_bad_content_length(length):
+    server = make_server(make_service(), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+        conn.putrequest("POST", "/batch")
+        if length is not None:
+            conn.putheader("Content-Length", length)
+        conn.endheaders(b'{"items": ["QUORN NUGGETS"]}')
+        assert conn.getresponse().status == 400
+    finally:
+        server.shutdown()
+        server.server_close()
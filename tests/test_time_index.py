@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from time_index import TimeIndex
+
+
+def test_missing_keys_are_counted():
+    dates = pd.Series(pd.to_datetime(["2016-01-01", "2016-01-02", "2016-01-03"]))
+    keys = pd.DataFrame({"category": ["A", None, np.nan], "outcomes": ["x", "y", "x"]})
+    index = TimeIndex(dates, keys)
+    assert index.count("2016-01-01", "2016-01-31", category=np.nan) == 2
+    assert index.count("2016-01-01", "2016-01-31", category=None, outcomes="x") == 1
+    assert index.count("2016-01-01", "2016-01-31", category=[None, "A"]) == 3